@@ -1,21 +1,47 @@
-import importlib
-import re
+import hashlib
+import hmac
+from collections import defaultdict
 from datetime import datetime
 
+from aiohttp.web import Request, Response, json_response
 from maubot import MessageEvent, Plugin
-from maubot.handlers import event
-from mautrix.errors.request import MatrixUnknownRequestError
-from mautrix.types import EventType, FileInfo, MediaMessageEventContent, MessageType
+from maubot.handlers import event, web
+from maubot.matrix import parse_formatted
+from mautrix.types import (
+    EventType,
+    FileInfo,
+    Format,
+    MediaMessageEventContent,
+    MessageType,
+    PowerLevelStateEventContent,
+    StateEvent,
+    TextMessageEventContent,
+)
 from mautrix.util import markdown
 from mautrix.util.async_db import UpgradeTable
 from mautrix.util.config import BaseProxyConfig, ConfigUpdateHelper
+from mautrix.util.formatter import parse_html
 
 # Setup database
+from .archive import Archive
+from .backends import configured_backends, fan_out
+from .classifier import LineClassifier
 from .db import upgrade_table
-from .util import get_room_name, time_from_timestamp
+from .dispatcher import Dispatcher
+from .export import MeetingExport
+from .ingest import IngestQueue
+from .jobs import JobQueue
+from .logline import LogLine
+from .metrics import CONTENT_TYPE, Gauge, Metrics, TimedDatabase
+from .startup import StartupReport
+from .util import TTLCache, get_room_name, time_from_timestamp, update_room_metadata
 
-COMMAND_RE = re.compile(r"^!(\S+)(?:\s+|$)(.*)")
-TOPIC_COMMAND_RE = re.compile(r"^!(topic)(?:\s+|$)(.*)")
+# Power levels are kept up to date from m.room.power_levels events, this is just a safety net
+# in case the bot misses one
+POWER_LEVELS_TTL = 60 * 60
+
+# How many log rows to fetch at a time when streaming a meeting's logs
+ITEMS_CHUNK_SIZE = 500
 
 
 class Config(BaseProxyConfig):
@@ -23,110 +49,293 @@ class Config(BaseProxyConfig):
         helper.copy("powerlevel")
         helper.copy("backend")
         helper.copy("backend_data")
+        helper.copy("archive_retention_days")
+        helper.copy("slow_event_seconds")
+        helper.copy("web_token")
         helper.copy("tags_command_at_start")
         helper.copy("tags_command_prefix")
         helper.copy("tags")
 
 
 class Meetings(Plugin):
+    # Importing twisted (via fedora-messaging) declares interfaces on abc.ABC, which leaves an
+    # inherited __provides__ attribute that raises AttributeError on instances. maubot looks up
+    # every attribute when registering handlers, so shadow it, or the plugin can't be reloaded
+    __provides__ = None
+
     async def start(self) -> None:
+        # How long each step of starting takes is logged, and kept in the metrics
+        startup = StartupReport()
         self.config.load_and_update()
-        if self.config.get("backend", None):
-            self.backend = importlib.import_module(
-                f'.backends.{self.config["backend"]}', package="meetings"
-            )
-        else:
-            self.backend = None
+
+        # Everything the plugin does is timed, including each database query
+        self.metrics = Metrics(self.log, self.config.get("slow_event_seconds", 0) or 0)
+        self.database = TimedDatabase(self.database, self.metrics)
+
+        # Every backend gets each meeting, and they run side by side. A backend that fails to
+        # set up is left out, rather than keeping the others from running
+        with startup.step("import backends"):
+            self.backends = configured_backends(self.config)
+
+        # Compiled jinja environments, one per backend, set up by the backend itself
+        self.j2envs = {}
+        with startup.step("setup backends"):
+            failed = await fan_out(self, self.backends, "setup")
+        self.backends = [backend for backend in self.backends if backend not in failed]
         self.tags = self.config["tags"]
         self.prefix = self.config.get("tags_command_prefix", "^")
-        start = "(^)" if self.config.get("tags_command_at_start", True) else "(^.*)"
-        self.tags_regex = re.compile(f"{start}\\{self.prefix}({'|'.join(self.tags.keys())})($| .*)")
+
+        # Commands that need the lines before them logged first, and what runs them. !topic is
+        # handled as the line is classified, as it's logged as a tag
+        self.commands = {
+            "meetingname": self.rename_meeting,
+            "startmeeting": self.startmeeting,
+            "endmeeting": self.endmeeting,
+            "minutes": self.show_minutes,
+            "archived": self.list_archived,
+            "rerender": self.rerender_meeting,
+            "search": self.search_archive,
+        }
+        self.classify = LineClassifier(
+            self.tags,
+            prefix=self.prefix,
+            at_start=self.config.get("tags_command_at_start", True),
+            commands=["topic", *self.commands],
+        )
+
+        # Meetings in progress, keyed by room_id. This mirrors the meetings table so that
+        # logging a message never needs a database round-trip just to find the meeting
+        self.active_meetings = {}
+        with startup.step("load meetings"):
+            for row in await self.database.fetch("SELECT * FROM meetings"):
+                self.active_meetings[row["room_id"]] = dict(row)
+
+        # Power levels per room_id, filled on first use by check_pl
+        self.power_levels = TTLCache(POWER_LEVELS_TTL)
+
+        # Rendered minutes of meetings in progress, keyed by meeting_id, along with the version
+        # they were rendered at. The version goes up whenever the minutes would change
+        self.minutes_cache = {}
+        self.minutes_versions = defaultdict(int)
+
+        self.metrics.add(
+            Gauge(
+                "meetings_active",
+                "Meetings in progress",
+                function=lambda: len(self.active_meetings),
+            )
+        )
+
+        # Feedback to rooms is sent in the background
+        self.dispatcher = Dispatcher(self.client, self.log, self.metrics)
+
+        # Message events are processed in order per room, a few rooms at a time
+        self.ingest = IngestQueue(self.handle_message)
+        self.metrics.add(
+            Gauge(
+                "meetings_ingest_queued",
+                "Message events waiting to be processed",
+                function=self.ingest.queued,
+            )
+        )
+
+        # Finished meetings are processed by the backends in the background, then archived
+        self.archive = Archive(self)
+        self.archive.start()
+        self.jobs = JobQueue(self)
+        self.jobs.start()
+
+        startup.finish(self.log, self.metrics)
+
+    async def stop(self) -> None:
+        await self.ingest.stop()
+        await self.dispatcher.stop()
+        await self.jobs.stop()
+        await self.archive.stop()
+        await fan_out(self, self.backends, "stop")
+        # start() wraps the database again, so hand back the one maubot gave us
+        self.database = self.database.wrapped
 
     async def check_pl(self, evt):
-        pls = await self.client.get_state_event(evt.room_id, EventType.ROOM_POWER_LEVELS)
+        pls = self.power_levels.get(evt.room_id)
+        if pls is None:
+            pls = await self.client.get_state_event(evt.room_id, EventType.ROOM_POWER_LEVELS)
+            self.power_levels[evt.room_id] = pls
         permit = pls.get_user_level(evt.sender) >= self.config["powerlevel"]
         return permit
 
+    @event.on(EventType.ROOM_POWER_LEVELS)
+    async def update_power_levels(self, evt: StateEvent) -> None:
+        if isinstance(evt.content, PowerLevelStateEventContent):
+            self.power_levels[evt.room_id] = evt.content
+
+    @event.on(EventType.ROOM_NAME)
+    async def update_room_name(self, evt: StateEvent) -> None:
+        update_room_metadata(evt.room_id, EventType.ROOM_NAME, evt.content.name or None)
+
+    @event.on(EventType.ROOM_CANONICAL_ALIAS)
+    async def update_room_alias(self, evt: StateEvent) -> None:
+        update_room_metadata(
+            evt.room_id, EventType.ROOM_CANONICAL_ALIAS, evt.content.canonical_alias or None
+        )
+
     # Helper: check if a meeting is ongoing in this room
-    async def meeting_in_progress(self, room_id):
-        dbq = """
-            SELECT * FROM meetings WHERE room_id = $1
-          """
-        row = await self.database.fetchrow(dbq, room_id)
-        return row
+    def meeting_in_progress(self, room_id):
+        return self.active_meetings.get(room_id)
 
-    # Helper: Get logs from the db
+    # Helper: Get logs from the db, as LogLines
     async def get_items(self, meeting_id, regex=False):
         if regex:
             dbq = (
-                "SELECT * FROM meeting_logs WHERE meeting_id = $1 AND tag LIKE $2 "
-                "ORDER BY timestamp, sender, line_num"
+                "SELECT * FROM meeting_logs "
+                "WHERE meeting_id = $1 AND tag IS NOT NULL AND tag LIKE $2 "
+                "ORDER BY timestamp, sender, line_num, id"
             )
             rows = await self.database.fetch(dbq, meeting_id, regex)
         else:
             dbq = """
-              SELECT * FROM meeting_logs WHERE meeting_id = $1 ORDER BY timestamp, sender, line_num
+              SELECT * FROM meeting_logs WHERE meeting_id = $1
+              ORDER BY timestamp, sender, line_num, id
             """
             rows = await self.database.fetch(dbq, meeting_id)
-        return rows
+        return [LogLine.from_row(row, self.prefix) for row in rows]
+
+    # Helper: Stream logs from the db a chunk at a time, so that long meetings never have to be
+    # held in memory all at once. Each chunk picks up after the last row of the previous one
+    async def iter_items(self, meeting_id, chunk_size=ITEMS_CHUNK_SIZE):
+        dbq = (
+            "SELECT * FROM meeting_logs WHERE meeting_id = $1 "
+            "ORDER BY timestamp, sender, line_num, id LIMIT $2"
+        )
+        rows = await self.database.fetch(dbq, meeting_id, chunk_size)
+        while rows:
+            for row in rows:
+                yield LogLine.from_row(row, self.prefix)
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1]
+            dbq = (
+                "SELECT * FROM meeting_logs WHERE meeting_id = $1 "
+                "AND (timestamp, sender, line_num, id) > ($2, $3, $4, $5) "
+                "ORDER BY timestamp, sender, line_num, id LIMIT $6"
+            )
+            rows = await self.database.fetch(
+                dbq,
+                meeting_id,
+                last["timestamp"],
+                last["sender"],
+                last["line_num"],
+                last["id"],
+                chunk_size,
+            )
+
+    # Helper: gather what the backends render about a meeting in one pass over its logs
+    async def export(self, meeting_id):
+        export = MeetingExport(meeting_id)
+        async for line in self.iter_items(meeting_id):
+            export.add(line)
+        return export
+
+    # Helper: what the live minutes need of a meeting in progress, without reading its whole log.
+    # The tagged lines and the first and last lines come from the index, and the line counts from
+    # meeting_attendance, which is kept up to date as lines are logged
+    async def live_export(self, meeting_id):
+        items = await self.get_items(meeting_id, regex="%")
+        first, last = await self.get_bounds(meeting_id)
+        people_present = await self.get_people_present(meeting_id)
+        return MeetingExport.from_tagged(meeting_id, items, first, last, people_present)
+
+    # Helper: Get the first and last lines of a meeting from the db
+    async def get_bounds(self, meeting_id):
+        dbq = (
+            "SELECT * FROM meeting_logs WHERE meeting_id = $1 "
+            "ORDER BY timestamp, sender, line_num, id LIMIT 1"
+        )
+        first = await self.database.fetchrow(dbq, meeting_id)
+        if first is None:
+            return None, None
+        dbq = (
+            "SELECT * FROM meeting_logs WHERE meeting_id = $1 "
+            "ORDER BY timestamp DESC, sender DESC, line_num DESC, id DESC LIMIT 1"
+        )
+        last = await self.database.fetchrow(dbq, meeting_id)
+        return LogLine.from_row(first, self.prefix), LogLine.from_row(last, self.prefix)
 
     # Helper: Get message counts from the db
     async def get_people_present(self, meeting_id):
         dbq = (
-            "SELECT sender, count(sender) as count "
-            "FROM meeting_logs "
+            "SELECT sender, lines as count "
+            "FROM meeting_attendance "
             "WHERE meeting_id = $1 "
-            "GROUP BY sender "
             "ORDER BY count"
         )
         rows = await self.database.fetch(dbq, meeting_id)
         return rows
 
-    async def react(self, evt, emoji):
-        try:
-            await evt.react(emoji)
-        except MatrixUnknownRequestError as e:
-            if e.errcode == "M_DUPLICATE_ANNOTATION":
-                pass
-            else:
-                raise e
-
-    async def log_tag(self, tag, line, evt: MessageEvent) -> None:
-        meeting = self.meeting_id(evt.room_id)
-        timestamp = evt.timestamp
-        dbq = (
-            "UPDATE meeting_logs SET tag = $3 WHERE meeting_id = $1 AND "
-            "timestamp = $2 AND message = $4"
-        )
-        await self.database.execute(dbq, meeting, str(timestamp), tag, line)
-
-    async def change_topic(self, topic, line, evt: MessageEvent) -> None:
-        dbq = """
-            UPDATE meetings SET topic = $3 WHERE meeting_id = $1 AND room_id = $2
-          """
-        await self.database.execute(dbq, self.meeting_id(evt.room_id), evt.room_id, topic)
-
-        # also update the log for the '!topic' command to be the topic it commanded to be
-        dbq = (
-            "UPDATE meeting_logs SET topic = $3 WHERE meeting_id = $1 "
-            "AND timestamp = $2 AND message = $4"
-        )
-        timestamp = evt.timestamp
-        await self.database.execute(dbq, self.meeting_id(evt.room_id), str(timestamp), topic, line)
+    # Helper: a notice rendered from markdown, like evt.respond sends, for the dispatcher
+    async def notice(self, text):
+        content = TextMessageEventContent(msgtype=MessageType.NOTICE, format=Format.HTML)
+        content.body, content.formatted_body = await parse_formatted(text, render_markdown=True)
+        return content
 
     async def change_meetingname(self, meetingname, evt: MessageEvent) -> None:
         dbq = """
             UPDATE meetings SET meeting_name = $3 WHERE meeting_id = $1 AND room_id = $2
           """
-        await self.database.execute(dbq, self.meeting_id(evt.room_id), evt.room_id, meetingname)
-
-    async def log_to_db(self, meeting, timestamp, sender, message, topic, line_num=0):
-        # Log the item to the db
+        meeting = self.active_meetings[evt.room_id]
+        await self.database.execute(dbq, meeting["meeting_id"], evt.room_id, meetingname)
+        meeting["meeting_name"] = meetingname
+        self.minutes_versions[meeting["meeting_id"]] += 1
+
+    async def log_to_db(self, meeting, timestamp, sender, lines):
+        # Log a whole event's worth of (line_num, message, tag, topic) items to the db in one
+        # transaction, moving the meeting on to the topic of the last line and adding them to
+        # the sender's line count
+        self.metrics.lines.inc(len(lines))
         dbq = (
-            "INSERT INTO meeting_logs (meeting_id, timestamp, sender, message, topic, line_num) "
-            "VALUES ($1, $2, $3, $4, $5, $6)"
+            "INSERT INTO meeting_logs "
+            "(meeting_id, timestamp, sender, message, tag, topic, line_num) "
+            "VALUES ($1, $2, $3, $4, $5, $6, $7)"
         )
-        await self.database.execute(dbq, meeting, str(timestamp), sender, message, topic, line_num)
+        records = [
+            (meeting["meeting_id"], timestamp, sender, message, tag, topic, line_num)
+            for line_num, message, tag, topic in lines
+        ]
+        topic = lines[-1][3]
+        async with self.database.acquire() as conn, conn.transaction():
+            await conn.executemany(dbq, records)
+            dbq = (
+                "INSERT INTO meeting_attendance (meeting_id, sender, lines) VALUES ($1, $2, $3) "
+                "ON CONFLICT (meeting_id, sender) "
+                "DO UPDATE SET lines = meeting_attendance.lines + excluded.lines"
+            )
+            await conn.execute(dbq, meeting["meeting_id"], sender, len(records))
+            if topic != meeting["topic"]:
+                dbq = """
+                    UPDATE meetings SET topic = $3 WHERE meeting_id = $1 AND room_id = $2
+                  """
+                await conn.execute(dbq, meeting["meeting_id"], meeting["room_id"], topic)
+        meeting["topic"] = topic
+
+    # Helper: the backend that renders the minutes so far, the first one configured that can
+    def minutes_backend(self):
+        return next((backend for backend in self.backends if backend.implements("minutes")), None)
+
+    # Helper: get the minutes of a meeting so far as (text, html, etag), rendered by the backend.
+    # They are only rendered again once a tagged line has been logged, so the line counts of the
+    # people present may lag behind until then
+    async def get_minutes(self, meeting):
+        meeting_id = meeting["meeting_id"]
+        version = self.minutes_versions[meeting_id]
+        cached = self.minutes_cache.get(meeting_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        export = await self.live_export(meeting_id)
+        text, html = await self.minutes_backend().call(self, "minutes", meeting, export)
+        etag = f'"{hashlib.sha256(html.encode()).hexdigest()[:32]}"'
+        self.minutes_cache[meeting_id] = (version, (text, html, etag))
+        return self.minutes_cache[meeting_id][1]
 
     # Helper: upload a file
     async def upload_file(self, evt, filename, file_contents):
@@ -149,7 +358,7 @@ class Meetings(Plugin):
         return f"{room_id}-{datetime.today().strftime('%Y-%m-%d')}"
 
     async def startmeeting(self, evt: MessageEvent, meetingname) -> None:
-        meeting = await self.meeting_in_progress(evt.room_id)
+        meeting = self.meeting_in_progress(evt.room_id)
         if not await self.check_pl(evt):
             await evt.respond(
                 f"Starting a meeting requires a powerlevel of at least {self.config['powerlevel']}"
@@ -169,28 +378,39 @@ class Meetings(Plugin):
                 "VALUES ($1, $2, $3, $4)"
             )
 
+            # an earlier meeting in this room today might still be being processed, or already
+            # archived, in which case it owns the usual meeting_id
+            meeting_id = self.meeting_id(evt.room_id)
+            if await self.jobs.is_queued(meeting_id) or await self.archive.contains(meeting_id):
+                meeting_id = f"{meeting_id}-{evt.timestamp}"
+
+            meeting = {
+                "room_id": evt.room_id,
+                "meeting_id": meeting_id,
+                "topic": initial_topic,
+                "meeting_name": meetingname,
+            }
             await self.database.execute(
-                dbq, evt.room_id, self.meeting_id(evt.room_id), initial_topic, meetingname
+                dbq,
+                meeting["room_id"],
+                meeting["meeting_id"],
+                meeting["topic"],
+                meeting["meeting_name"],
             )
-            meeting = await self.meeting_in_progress(evt.room_id)
+            self.active_meetings[evt.room_id] = meeting
 
             # the !startmeeting command gets sent before the meeting has been
             # started, so manually log that message
             await self.log_to_db(
-                self.meeting_id(evt.room_id),
-                evt.timestamp,
-                evt.sender,
-                evt.content.body,
-                initial_topic,
+                meeting, evt.timestamp, evt.sender, [(0, evt.content.body, None, initial_topic)]
             )
 
-            # Do backend-specific startmeeting things
-            if self.backend:
-                await self.backend.startmeeting(self, evt, meeting)
-
             # Notify the room
-            await evt.respond(f"Meeting started at {time_from_timestamp(evt.timestamp)} UTC")
-            await evt.respond(f"The Meeting name is '{meetingname}'")
+            started = f"Meeting started at {time_from_timestamp(evt.timestamp)} UTC"
+            self.dispatcher.send(evt.room_id, await self.notice(started))
+            self.dispatcher.send(
+                evt.room_id, await self.notice(f"The Meeting name is '{meetingname}'")
+            )
 
             # provide some helpful hints
             prefix = self.prefix.strip("\\")
@@ -201,6 +421,7 @@ class Meetings(Plugin):
                 f"reminds you of the things that can do in the meeting:\n"
                 f"* `!meetingname <a new name>`: to rename the meeting\n"
                 f"* `!topic <a topic name>`: to change the topic of the meeting\n"
+                f"* `!minutes`: to see the minutes so far\n"
                 f"* `!endmeeting`: to, well, end the meeting\n"
                 f"\n"
                 f"There are also several handy tags that you can use to tag a "
@@ -208,12 +429,21 @@ class Meetings(Plugin):
                 f"{tags_string}"
             )
 
-            await self.client.send_text(
-                evt.room_id, None, html=markdown.render(hints), msgtype=MessageType.EMOTE
+            html = markdown.render(hints)
+            content = TextMessageEventContent(
+                msgtype=MessageType.EMOTE,
+                body=await parse_html(html),
+                format=Format.HTML,
+                formatted_body=html,
             )
+            self.dispatcher.send(evt.room_id, content)
+
+            # Do backend-specific startmeeting things in the background, once the replies are on
+            # their way, so a slow backend doesn't hold up logging the room's next messages
+            self.dispatcher.spawn(fan_out(self, self.backends, "startmeeting", evt, meeting))
 
-    async def endmeeting(self, evt: MessageEvent) -> None:
-        meeting = await self.meeting_in_progress(evt.room_id)
+    async def endmeeting(self, evt: MessageEvent, _argument: str = "") -> None:
+        meeting = self.meeting_in_progress(evt.room_id)
 
         if meeting:
             if not await self.check_pl(evt):
@@ -222,32 +452,27 @@ class Meetings(Plugin):
                     f"of at least {self.config['powerlevel']}"
                 )
             else:
-                meeting_id = self.meeting_id(evt.room_id)
-
-                # Do backend-specific endmeeting things
-                if self.config["backend"]:
-                    await self.backend.endmeeting(self, evt, meeting)
-
-                #  Notify the room
-                await evt.respond(f"Meeting ended at {time_from_timestamp(evt.timestamp)} UTC")
-
-                # Clear the logs
-                dbq = """
-                DELETE FROM meeting_logs WHERE meeting_id = $1
-              """
-                await self.database.execute(dbq, meeting_id)
-
-                # Remove the meeting from the meetings table
+                # Remove the meeting from the meetings table, and hand it to the job queue for
+                # the backend-specific endmeeting things. The logs are archived once that's done
                 dbq = """
                 DELETE FROM meetings WHERE room_id = $1
               """
-                await self.database.execute(dbq, evt.room_id)
+                async with self.database.acquire() as conn, conn.transaction():
+                    await self.jobs.add(conn, evt, meeting)
+                    await conn.execute(dbq, evt.room_id)
+                self.active_meetings.pop(evt.room_id, None)
+                self.minutes_cache.pop(meeting["meeting_id"], None)
+                self.minutes_versions.pop(meeting["meeting_id"], None)
+                self.jobs.wakeup.set()
+
+                #  Notify the room
+                await evt.respond(f"Meeting ended at {time_from_timestamp(evt.timestamp)} UTC")
 
         else:
             await evt.respond("No meeting in progress")
 
     async def rename_meeting(self, evt: MessageEvent, name: str = "") -> None:
-        meeting = await self.meeting_in_progress(evt.room_id)
+        meeting = self.meeting_in_progress(evt.room_id)
 
         if meeting:
             if not await self.check_pl(evt):
@@ -260,70 +485,214 @@ class Meetings(Plugin):
                     await self.change_meetingname(name, evt)
                     await evt.respond(f"The Meeting Name is now {name}")
 
-    async def handle_topic(self, evt: MessageEvent, name, line) -> None:
-        meeting = await self.meeting_in_progress(evt.room_id)
+    async def list_archived(self, evt: MessageEvent, _argument: str = "") -> None:
+        meetings = await self.archive.list(evt.room_id)
+        if not meetings:
+            await evt.respond("No archived meetings in this room")
+            return
 
-        if meeting:
-            if not await self.check_pl(evt):
-                await evt.respond(
-                    f"Changing the topic requires a powerlevel "
-                    f"of at least {self.config['powerlevel']}"
+        lines = [
+            f"* `{m['meeting_id']}`: {m['meeting_name']} "
+            f"({time_from_timestamp(m['started']) if m['started'] else 'no logs'})"
+            for m in meetings
+        ]
+        await evt.respond("Archived meetings in this room:\n" + "\n".join(lines))
+
+    async def rerender_meeting(self, evt: MessageEvent, meeting_id: str = "") -> None:
+        if not await self.check_pl(evt):
+            await evt.respond(
+                f"Rendering a meeting again requires a powerlevel "
+                f"of at least {self.config['powerlevel']}"
+            )
+            return
+        if not meeting_id:
+            await evt.respond("Which meeting? `!archived` lists the meetings in this room")
+            return
+
+        # Put the logs back where the backend expects them, and queue the meeting like it had
+        # just ended. The !rerender event is the one the backend replies to
+        archived = await self.archive.get_metadata(meeting_id)
+        if not archived or archived["room_id"] != evt.room_id:
+            await evt.respond(f"No archived meeting {meeting_id} in this room")
+            return
+        meeting = self.meeting_in_progress(evt.room_id)
+        if meeting and meeting["meeting_id"] == meeting_id:
+            await evt.respond(f"Meeting {meeting_id} is in progress")
+            return
+        async with self.database.acquire() as conn, conn.transaction():
+            meeting = await self.archive.restore(conn, meeting_id)
+            await self.jobs.add(conn, evt, meeting)
+        self.jobs.wakeup.set()
+        await evt.respond(f"Rendering {meeting['meeting_name']} ({meeting_id}) again")
+
+    async def search_archive(self, evt: MessageEvent, terms: str = "") -> None:
+        if not terms:
+            await evt.respond("What should I search for? e.g. `!search some words`")
+            return
+
+        hits = await self.archive.search(evt.room_id, terms)
+        if not hits:
+            await evt.respond(f"No archived meetings in this room mention {terms}")
+            return
+
+        lines = []
+        for hit in hits:
+            topic = f" / {hit['topic']}" if hit["topic"] else ""
+            lines.append(
+                f"* {time_from_timestamp(hit['timestamp'])} {hit['meeting_name']}{topic}: "
+                f"{hit['message']}"
+            )
+        await evt.respond("\n".join(lines), markdown=False)
+
+    def web_denied(self, request: Request) -> Response | None:
+        """Check a request for a room's page carries the configured web_token, as a Bearer token
+        or a ``token`` query parameter. Returns the response to send if it doesn't"""
+        token = self.config.get("web_token", "") or ""
+        if not token:
+            # the room pages aren't served at all unless there's a token to protect them
+            return Response(status=404, text="Not found")
+        given = request.query.get("token", "")
+        authorization = request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            given = authorization.removeprefix("Bearer ")
+        if not hmac.compare_digest(given.encode(), token.encode()):
+            return Response(status=401, text="Unauthorized", headers={"WWW-Authenticate": "Bearer"})
+        return None
+
+    @web.get("/search/{room_id}")
+    async def search_page(self, request: Request) -> Response:
+        if denied := self.web_denied(request):
+            return denied
+        hits = await self.archive.search(request.match_info["room_id"], request.query.get("q", ""))
+        return json_response([dict(hit) for hit in hits])
+
+    async def show_minutes(self, evt: MessageEvent, _argument: str = "") -> None:
+        meeting = self.meeting_in_progress(evt.room_id)
+
+        if not meeting:
+            await evt.respond("No meeting in progress")
+        elif not self.minutes_backend():
+            await evt.respond("Minutes are only available when a backend is configured")
+        else:
+            text, html, _ = await self.get_minutes(meeting)
+            if text:
+                await evt.respond(text, markdown=False)
+            else:
+                content = TextMessageEventContent(
+                    msgtype=MessageType.NOTICE,
+                    body=await parse_html(html),
+                    format=Format.HTML,
+                    formatted_body=html,
                 )
+                await evt.respond(content)
+
+    @web.get("/metrics")
+    async def metrics_page(self, request: Request) -> Response:
+        return Response(body=self.metrics.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    @web.get("/minutes/{room_id}")
+    async def minutes_page(self, request: Request) -> Response:
+        if denied := self.web_denied(request):
+            return denied
+        meeting = self.meeting_in_progress(request.match_info["room_id"])
+        if not meeting or not self.minutes_backend():
+            return Response(status=404, text="No meeting in progress")
+
+        _, html, etag = await self.get_minutes(meeting)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]
+        if etag in if_none_match or "*" in if_none_match:
+            return Response(status=304, headers=headers)
+        return Response(text=html, content_type="text/html", headers=headers)
+
+    async def flush_lines(self, evt, meeting, pending) -> None:
+        if not pending:
+            return
+
+        await self.log_to_db(
+            meeting,
+            evt.timestamp,
+            evt.sender,
+            [(line_num, line, tag, topic) for line_num, line, tag, topic, _ in pending],
+        )
+
+        if any(tag for _, _, tag, _, _ in pending):
+            self.minutes_versions[meeting["meeting_id"]] += 1
+
+        # Now that the lines are safely stored, let the room know what we did with them: one
+        # message echoing every tag in the event, and one reaction per emoji
+        echoes = []
+        emojis = []
+        for _, _, tag, topic, tag_text in pending:
+            if not tag:
+                continue
+            self.metrics.tags.inc(tag=tag)
+            if tag == "topic":
+                echoes.append(f"The Meeting Topic is now {topic}")
             else:
-                if name:
-                    await self.log_tag("topic", line, evt)
-                    await self.change_topic(name, line, evt)
-                    await self.client.send_text(
-                        evt.room_id, f"The Meeting Topic is now {name}", msgtype=MessageType.EMOTE
-                    )
+                echoes.append(f"{self.tags[tag]}{tag.upper()}:{tag_text}")
+                if self.tags[tag] not in emojis:
+                    emojis.append(self.tags[tag])
+        if echoes:
+            content = TextMessageEventContent(msgtype=MessageType.EMOTE, body="\n".join(echoes))
+            self.dispatcher.send(evt.room_id, content)
+        for emoji in emojis:
+            self.dispatcher.react(evt.room_id, evt.event_id, emoji)
 
     @event.on(EventType.ROOM_MESSAGE)
     async def log_message(self, evt):
         if evt.content.msgtype not in [MessageType.TEXT, MessageType.NOTICE]:
             return
 
+        # Without a meeting, only commands do anything. That can't change under us unless the
+        # room has earlier events still to be processed, which might start one
+        if (
+            not self.ingest.busy(evt.room_id)
+            and not self.meeting_in_progress(evt.room_id)
+            and not any(line.startswith("!") for line in evt.content.body.splitlines())
+        ):
+            return
+
+        await self.ingest.submit(evt.room_id, evt)
+
+    async def handle_message(self, evt):
+        with self.metrics.span(self.metrics.event_seconds):
+            await self.process_message(evt)
+
+    async def process_message(self, evt):
         lines = evt.content.body.splitlines()
 
         if len(lines) > 1 and lines[0].startswith("!startmeeting"):
             await evt.respond("Sorry, `!startmeeting` must be called by itself")
             return
+
+        # Lines are classified first and then written together. Commands that start, end or
+        # rename the meeting need everything before them to be logged, so they flush early
+        meeting = self.meeting_in_progress(evt.room_id)
+        pending = []
         for line_num, line in enumerate(lines):
-            meeting = await self.meeting_in_progress(evt.room_id)
-            if meeting:
-                await self.log_to_db(
-                    self.meeting_id(evt.room_id),
-                    evt.timestamp,
-                    evt.sender,
-                    line,
-                    meeting["topic"],
-                    line_num=line_num,
-                )
+            command, argument, tag, tag_text = self.classify(line)
 
-                tagsmatch = re.findall(self.tags_regex, line)
-                if tagsmatch and len(tagsmatch) == 1:
-                    self.log.error(f"{tagsmatch[0][1]} {line}")
-                    await self.log_tag(tagsmatch[0][1], line, evt)
-                    await self.client.send_text(
-                        evt.room_id,
-                        (
-                            f"{self.tags[tagsmatch[0][1]]}{tagsmatch[0][1].upper()}:"
-                            f"{tagsmatch[0][2]}"
-                        ),
-                        msgtype=MessageType.EMOTE,
-                    )
-                    await self.react(evt, self.tags[tagsmatch[0][1]])
-
-            commandsmatch = COMMAND_RE.search(line)
-            if commandsmatch:
-                command, argument = commandsmatch.groups()
-                if command in ["topic", "t"]:
-                    await self.handle_topic(evt, argument, line)
-                elif command in ["meetingname", "mn"]:
-                    await self.rename_meeting(evt, argument)
-                elif command in ["startmeeting", "sm"]:
-                    await self.startmeeting(evt, argument)
-                elif command in ["endmeeting", "em"]:
-                    await self.endmeeting(evt)
+            if meeting:
+                topic = pending[-1][3] if pending else meeting["topic"]
+                if command == "topic" and argument:
+                    if await self.check_pl(evt):
+                        tag, topic = "topic", argument
+                    else:
+                        await evt.respond(
+                            f"Changing the topic requires a powerlevel "
+                            f"of at least {self.config['powerlevel']}"
+                        )
+                pending.append((line_num, line, tag, topic, tag_text))
+
+            if command in self.commands:
+                await self.flush_lines(evt, meeting, pending)
+                pending = []
+                with self.metrics.span(self.metrics.command_seconds, command=command):
+                    await self.commands[command](evt, argument)
+                meeting = self.meeting_in_progress(evt.room_id)
+
+        await self.flush_lines(evt, meeting, pending)
 
     @classmethod
     def get_config_class(cls) -> type[BaseProxyConfig]:
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import time
+import zlib
+
+from mautrix.util.async_db import Scheme
+
+from .worker import Worker
+
+# Archived logs are kept as one zlib-compressed JSON list per meeting
+ARCHIVE_COMPRESSION_LEVEL = 9
+ARCHIVE_COLUMNS = ("timestamp", "sender", "message", "tag", "topic", "line_num")
+
+# How many hits a search returns by default
+SEARCH_LIMIT = 10
+
+# How often expired meetings are pruned from the archive, in seconds
+ARCHIVE_PRUNE_INTERVAL = 60 * 60 * 24
+
+
+def compress_logs(rows):
+    logs = [[row[column] for column in ARCHIVE_COLUMNS] for row in rows]
+    return zlib.compress(json.dumps(logs).encode(), ARCHIVE_COMPRESSION_LEVEL)
+
+
+def fts5_query(terms):
+    """Quote each search term, so FTS5 doesn't try to parse them as query syntax"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms.split())
+
+
+def decompress_logs(meeting_id, blob):
+    logs = json.loads(zlib.decompress(blob))
+    return [dict(zip(ARCHIVE_COLUMNS, line, strict=True), meeting_id=meeting_id) for line in logs]
+
+
+class Archive(Worker):
+    """Keeps the logs of finished meetings once their backend is done with them.
+
+    Each meeting becomes a single row in ``meeting_archive``, with its metadata in columns and
+    its logs compressed into one blob, so ``meeting_logs`` only holds meetings that are still
+    going or waiting for their backend. The lines are also added to ``meeting_search``, a
+    full-text index (FTS5 on SQLite, a GIN-indexed tsvector on Postgres). Meetings older than
+    ``archive_retention_days`` are pruned in the background; a retention of 0 keeps them forever.
+    """
+
+    doing = "pruning the meeting archive"
+    error_delay = ARCHIVE_PRUNE_INTERVAL
+
+    def __init__(self, meetbot):
+        super().__init__(meetbot.log)
+        self.meetbot = meetbot
+        self.database = meetbot.database
+
+    @property
+    def retention(self):
+        return int(self.meetbot.config.get("archive_retention_days", 0) or 0) * 60 * 60 * 24
+
+    async def run_once(self):
+        await self.prune()
+        return ARCHIVE_PRUNE_INTERVAL
+
+    async def prune(self):
+        """Delete archived meetings that are past the retention period, returning how many"""
+        if not self.retention:
+            return 0
+        async with self.database.acquire() as conn, conn.transaction():
+            dbq = "SELECT COUNT(*) FROM meeting_archive WHERE archived_at < $1"
+            cutoff = int(time.time()) - self.retention
+            count = await conn.fetchval(dbq, cutoff)
+            dbq = """
+              DELETE FROM meeting_search WHERE meeting_id IN
+                (SELECT meeting_id FROM meeting_archive WHERE archived_at < $1)
+            """
+            await conn.execute(dbq, cutoff)
+            await conn.execute("DELETE FROM meeting_archive WHERE archived_at < $1", cutoff)
+        if count:
+            self.meetbot.log.info(f"Pruned {count} meetings from the archive")
+        return count
+
+    async def add(self, conn, meeting):
+        """Move a meeting's logs into the archive, as part of the transaction on ``conn``"""
+        dbq = (
+            "SELECT * FROM meeting_logs WHERE meeting_id = $1 "
+            "ORDER BY timestamp, sender, line_num, id"
+        )
+        rows = await conn.fetch(dbq, meeting["meeting_id"])
+        archive_id = meeting["meeting_id"]
+        dbq = "SELECT 1 FROM meeting_archive WHERE meeting_id = $1"
+        if await conn.fetchval(dbq, archive_id) is not None:
+            if not rows:
+                # already archived, there's nothing left to move
+                return
+            # a different meeting was archived under this id, before new meeting ids were checked
+            # against the archive, so keep both
+            archive_id = f"{archive_id}-{rows[0]['timestamp']}"
+            self.meetbot.log.warning(
+                f"Meeting {meeting['meeting_id']} is already archived, archiving as {archive_id}"
+            )
+        blob = await asyncio.to_thread(compress_logs, rows)
+
+        dbq = """
+          INSERT INTO meeting_archive
+            (meeting_id, room_id, meeting_name, topic, started, ended, lines, archived_at, logs)
+          VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+          ON CONFLICT (meeting_id) DO NOTHING
+        """
+        await conn.execute(
+            dbq,
+            archive_id,
+            meeting["room_id"],
+            meeting["meeting_name"],
+            meeting["topic"],
+            rows[0]["timestamp"] if rows else None,
+            rows[-1]["timestamp"] if rows else None,
+            len(rows),
+            int(time.time()),
+            blob,
+        )
+        dbq = (
+            "INSERT INTO meeting_search (message, meeting_id, timestamp, topic) "
+            "VALUES ($1, $2, $3, $4)"
+        )
+        await conn.executemany(
+            dbq,
+            [(row["message"], archive_id, row["timestamp"], row["topic"]) for row in rows],
+        )
+        await conn.execute("DELETE FROM meeting_logs WHERE meeting_id = $1", meeting["meeting_id"])
+        dbq = "DELETE FROM meeting_attendance WHERE meeting_id = $1"
+        await conn.execute(dbq, meeting["meeting_id"])
+
+    async def contains(self, meeting_id):
+        """Whether a meeting with this id is in the archive"""
+        dbq = "SELECT 1 FROM meeting_archive WHERE meeting_id = $1"
+        return await self.database.fetchval(dbq, meeting_id) is not None
+
+    async def get(self, meeting_id):
+        """Get an archived meeting's metadata and logs, or None if it isn't in the archive"""
+        row = await self.database.fetchrow(
+            "SELECT * FROM meeting_archive WHERE meeting_id = $1", meeting_id
+        )
+        if row is None:
+            return None
+        meeting = dict(row)
+        blob = meeting.pop("logs")
+        return meeting, await asyncio.to_thread(decompress_logs, meeting_id, blob)
+
+    async def get_metadata(self, meeting_id):
+        """Get an archived meeting's metadata, or None if it isn't in the archive"""
+        # everything but the logs, so there's nothing to decompress
+        dbq = """
+          SELECT meeting_id, room_id, meeting_name, topic, started, ended, lines, archived_at
+          FROM meeting_archive WHERE meeting_id = $1
+        """
+        return await self.database.fetchrow(dbq, meeting_id)
+
+    async def list(self, room_id, limit=10):
+        """The metadata of the latest meetings archived from a room"""
+        dbq = """
+          SELECT meeting_id, room_id, meeting_name, topic, started, ended, lines, archived_at
+          FROM meeting_archive WHERE room_id = $1 ORDER BY started DESC LIMIT $2
+        """
+        return await self.database.fetch(dbq, room_id, limit)
+
+    async def restore(self, conn, meeting_id):
+        """Move an archived meeting's logs back into meeting_logs, as part of the transaction on
+        ``conn``, so the backend can process it again. Returns the meeting, or None"""
+        dbq = "SELECT * FROM meeting_archive WHERE meeting_id = $1"
+        row = await conn.fetchrow(dbq, meeting_id)
+        if row is None:
+            return None
+        meeting = dict(row)
+        items = await asyncio.to_thread(decompress_logs, meeting_id, meeting.pop("logs"))
+
+        dbq = """
+          INSERT INTO meeting_logs (meeting_id, timestamp, sender, message, tag, topic, line_num)
+          VALUES ($1, $2, $3, $4, $5, $6, $7)
+        """
+        await conn.executemany(
+            dbq,
+            [tuple(item[column] for column in ("meeting_id", *ARCHIVE_COLUMNS)) for item in items],
+        )
+        dbq = (
+            "INSERT INTO meeting_attendance (meeting_id, sender, lines) "
+            "SELECT meeting_id, sender, COUNT(*) FROM meeting_logs WHERE meeting_id = $1 "
+            "GROUP BY meeting_id, sender"
+        )
+        await conn.execute(dbq, meeting_id)
+        await conn.execute("DELETE FROM meeting_search WHERE meeting_id = $1", meeting_id)
+        await conn.execute("DELETE FROM meeting_archive WHERE meeting_id = $1", meeting_id)
+        return meeting
+
+    async def search(self, room_id, terms, limit=SEARCH_LIMIT):
+        """Lines of the meetings archived from a room that match ``terms``, best match first"""
+        if not terms.strip():
+            return []
+        if self.database.scheme == Scheme.SQLITE:
+            dbq = """
+              SELECT s.meeting_id, a.meeting_name, s.topic, s.timestamp, s.message
+              FROM meeting_search s JOIN meeting_archive a ON a.meeting_id = s.meeting_id
+              WHERE meeting_search MATCH $1 AND a.room_id = $2
+              ORDER BY s.rank LIMIT $3
+            """
+            return await self.database.fetch(dbq, fts5_query(terms), room_id, limit)
+        dbq = """
+          SELECT s.meeting_id, a.meeting_name, s.topic, s.timestamp, s.message
+          FROM meeting_search s JOIN meeting_archive a ON a.meeting_id = s.meeting_id,
+            websearch_to_tsquery('english', $1) query
+          WHERE s.document @@ query AND a.room_id = $2
+          ORDER BY ts_rank(s.document, query) DESC LIMIT $3
+        """
+        return await self.database.fetch(dbq, terms, room_id, limit)
@@ -0,0 +1,103 @@
+import asyncio
+
+import jinja2
+
+from ..startup import import_timed
+
+# The backends that can be configured. Each is only imported once it's configured, and imports
+# its own heavy dependencies lazily, when they're first used
+BACKENDS = ("ansible", "fedora")
+
+# How long a backend gets to handle each call, in seconds, unless its backend_data has a
+# timeout_seconds of its own
+BACKEND_TIMEOUT = 10 * 60
+
+
+def load_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return import_timed(f".{name}", __name__)
+
+
+class Backend:
+    """A configured backend, and the interface the plugin calls it through.
+
+    A backend is a module with ``setup``, ``startmeeting`` and ``endmeeting`` coroutines, and
+    optionally ``stop`` and ``minutes``, each taking the plugin as their first argument. Every
+    call is timed, and given up on after ``timeout`` seconds.
+    """
+
+    def __init__(self, name, module, timeout=BACKEND_TIMEOUT):
+        self.name = name
+        self.module = module
+        self.timeout = timeout
+
+    def implements(self, phase):
+        return hasattr(self.module, phase)
+
+    async def call(self, meetbot, phase, *args):
+        with meetbot.metrics.span(meetbot.metrics.backend_seconds, backend=self.name, phase=phase):
+            return await asyncio.wait_for(
+                getattr(self.module, phase)(meetbot, *args), timeout=self.timeout
+            )
+
+
+def configured_backends(config):
+    """The backends named by the config's ``backend``, which is a name or a list of names"""
+    names = config.get("backend", None) or []
+    if isinstance(names, str):
+        names = [names]
+    backends = []
+    for name in names:
+        backend_data = (config.get("backend_data", None) or {}).get(name) or {}
+        timeout = backend_data.get("timeout_seconds", BACKEND_TIMEOUT)
+        backends.append(Backend(name, load_backend(name), timeout))
+    return backends
+
+
+async def fan_out(meetbot, backends, phase, *args):
+    """Call ``phase`` on every backend that implements it, all at once, and wait for them all.
+
+    A backend that fails or times out doesn't affect the others. Its error is logged, and it's
+    in the list of backends that failed, which is returned.
+    """
+    backends = [backend for backend in backends if backend.implements(phase)]
+    results = await asyncio.gather(
+        *(backend.call(meetbot, phase, *args) for backend in backends), return_exceptions=True
+    )
+    failed = []
+    for backend, result in zip(backends, results, strict=True):
+        if isinstance(result, asyncio.TimeoutError):
+            meetbot.log.error(f"Backend {backend.name} {phase} timed out after {backend.timeout}s")
+        elif isinstance(result, BaseException):
+            meetbot.log.error(f"Backend {backend.name} {phase} failed: {result!r}", exc_info=result)
+        else:
+            continue
+        failed.append(backend)
+    return failed
+
+
+async def load_templates(meetbot, backend, templatenames, filters=None):
+    """Build a backend's jinja environment, with all of its templates already compiled.
+
+    The templates are read from the plugin once, up front, so rendering at the end of a meeting
+    doesn't need any file I/O or parsing. The environment is async, so the log templates can
+    loop straight over ``Meetings.iter_items``. Lines come as ``LogLine``s, which already have
+    their timestamps formatted and their tags taken off, so the templates need few filters.
+    """
+    sources = {}
+    for templatename in templatenames:
+        source = await meetbot.loader.read_file(f"meetings/backends/{backend}/{templatename}")
+        sources[templatename] = source.decode()
+
+    j2env = jinja2.Environment(
+        loader=jinja2.DictLoader(sources),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        enable_async=True,
+        autoescape=lambda templatename: templatename.startswith("html_"),  # noqa: S701
+    )
+    j2env.filters.update(filters or {})
+    for templatename in templatenames:
+        j2env.get_template(templatename)
+    meetbot.j2envs[backend] = j2env
@@ -1,11 +1,18 @@
+import asyncio
 import json
-import tempfile
-from datetime import datetime
 
-import jinja2
-import requests
+import aiohttp
 
-from ...util import get_room_alias, get_room_name, time_from_timestamp
+from ...util import get_room_info
+from .. import load_templates
+
+TEMPLATES = ["text_log.j2", "html_minutes.j2"]
+
+# Discourse requests give up after this long, and are tried this many times with exponential
+# backoff starting at DISCOURSE_BACKOFF seconds
+DISCOURSE_TIMEOUT = aiohttp.ClientTimeout(total=60)
+DISCOURSE_RETRIES = 3
+DISCOURSE_BACKOFF = 2
 
 
 # helpers
@@ -14,139 +21,188 @@ def config(meetbot):
     return config
 
 
-def parse_db_time(t):
-    return datetime.utcfromtimestamp(int(t) / 1000).strftime("%Y-%m-%d %H:%M:%S")
+async def setup(meetbot):
+    await load_templates(meetbot, "ansible", TEMPLATES)
 
 
-def parse_db_logs(items):
-    logs = tuple()
-    for row in items:
-        time = parse_db_time(row[1])
-        log = f"{time} | {row[2]} | {row[3]}"
-        logs += (log,)
+async def render(meetbot, templatename, **kwargs):
+    template = meetbot.j2envs["ansible"].get_template(templatename)
+    return await template.render_async(**kwargs)
 
-    log_data = "\n".join(logs).encode("utf-8")
-    return log_data
 
+class DiscourseError(Exception):
+    """Discourse couldn't be reached, or kept rate limiting us, so nothing was posted and posting
+    again is safe"""
 
-def render(meetbot, templatename, **kwargs):
-    def formatdate(timestamp):
-        """timestampt to date filter"""
-        return time_from_timestamp(int(timestamp))
 
-    def formattime(timestamp):
-        """timestampt to date filter"""
-        return time_from_timestamp(int(timestamp), format="%H:%M:%S")
+class DiscourseRejected(DiscourseError):
+    """Discourse turned the request down, and would turn it down again"""
 
-    def removecommand(line, command=""):
-        return line.removeprefix(f"^{command}").strip()
-
-    j2env = jinja2.Environment(
-        trim_blocks=True,
-        lstrip_blocks=True,
-        autoescape=jinja2.select_autoescape(["html", "xml"]),
-    )
-    j2env.filters["formatdate"] = formatdate
-    j2env.filters["formattime"] = formattime
-    j2env.filters["removecommand"] = removecommand
 
-    template = meetbot.loader.sync_read_file(f"meetings/backends/ansible/{templatename}")
-    return j2env.from_string(template.decode()).render(**kwargs)
+class DiscourseUncertain(DiscourseError):
+    """The request failed after it was sent, so Discourse might have acted on it"""
 
 
 # async helpers
-async def upload_log_to_discourse(config, log_data, logger):
-    # DRY this
-    api_user = config["discourse_user"]
-    api_key = config["discourse_key"]
-    url = config["discourse_url"] + "/uploads.json"
-
-    headers = {"Api-Key": api_key, "Api-Username": api_user}
-
-    fp = tempfile.TemporaryFile()
-    fp.write(str.encode(log_data))
-    fp.seek(0)
-
-    res = requests.post(  # noqa: S113
-        url,
-        headers=headers,
-        data={"type": "text"},
-        files={"files[]": ("full_log.txt", fp, "text/plain")},
-    )
-
-    fp.close()
+async def discourse_post(http, config, path, logger, data):
+    """POST to Discourse, retrying with backoff if it is rate limiting us or can't be reached.
+
+    Creating a post isn't idempotent, so a request that Discourse might have acted on is never
+    sent again. If the request times out or loses its connection once sent, this raises
+    DiscourseUncertain.
+
+    ``data`` is a callable returning the request body, as a multipart body can only be sent once.
+    Returns the status and body of the last response, or ``(None, b"")`` if there wasn't one.
+    """
+    url = config["discourse_url"] + path
+    headers = {"Api-Key": config["discourse_key"], "Api-Username": config["discourse_user"]}
+
+    status, content = None, b""
+    for attempt in range(DISCOURSE_RETRIES):
+        if attempt:
+            await asyncio.sleep(DISCOURSE_BACKOFF * 2 ** (attempt - 1))
+        try:
+            async with http.post(
+                url, headers=headers, data=data(), timeout=DISCOURSE_TIMEOUT
+            ) as res:
+                status, content = res.status, await res.read()
+        except aiohttp.ClientConnectorError as e:
+            # the request was never sent, so sending it again is safe
+            logger.warning(f"error contacting Discourse (attempt {attempt + 1}): {e!r}")
+            continue
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DiscourseUncertain(f"request to {path} failed once sent: {e!r}") from e
+        if status != 429:
+            break
+        logger.warning(f"rate limited by Discourse (attempt {attempt + 1})")
+    return status, content
+
+
+async def upload_log_to_discourse(http, config, log_data, logger):
+    def data():
+        form = aiohttp.FormData()
+        form.add_field("type", "text")
+        form.add_field(
+            "files[]", log_data.encode(), filename="full_log.txt", content_type="text/plain"
+        )
+        return form
+
+    # the minutes are still worth posting without the log, so failing here isn't fatal
+    try:
+        status, content = await discourse_post(http, config, "/uploads.json", logger, data)
+    except DiscourseError as e:
+        logger.warning(f"error uploading: {e}")
+        return ""
 
-    if res.status_code == 200:
-        r = json.loads(res.content)
+    if status == 200:
+        r = json.loads(content)
         txt = f"[full_log.txt|attachment]({r['short_url']})"
         return txt
     else:
-        logger.warning(f"error uploading: {res.status_code} - {res.content}")
+        logger.warning(f"error uploading: {status} - {content}")
         return ""
 
 
-async def post_to_discourse(config, raw_post, title, logger):
-    api_user = config["discourse_user"]
-    api_key = config["discourse_key"]
-    url = config["discourse_url"] + "/posts"
+async def post_to_discourse(http, config, raw_post, title, logger):
+    payload = {"title": title, "raw": raw_post, "category": str(config["category_id"])}
 
-    headers = {"Api-Key": api_key, "Api-Username": api_user}
-    payload = {"title": title, "raw": raw_post, "category": config["category_id"]}
-
-    res = requests.post(url, headers=headers, data=payload)  # noqa: S113
-    logger.info(f"Discourse POST: {res.status_code}")
-    if res.status_code == 200:
-        r = json.loads(res.content)
-        return r["topic_id"]
-    else:
-        logger.warning(f"error posting: {res.status_code} - {res.content}")
-        return ""
+    status, content = await discourse_post(http, config, "/posts", logger, lambda: payload)
+    logger.info(f"Discourse POST: {status}")
+    if status is None or status == 429:
+        raise DiscourseError(f"error posting: {status}")
+    if 400 <= status < 500:
+        raise DiscourseRejected(f"error posting: {status} - {content}")
+    if status != 200:
+        raise DiscourseUncertain(f"error posting: {status} - {content}")
+    r = json.loads(content)
+    return r["topic_id"]
 
 
 # required backend methods
 async def startmeeting(meetbot, event, meeting):
-    room_alias = await get_room_alias(meetbot.client, event.room_id)
-    room_name = await get_room_name(meetbot.client, event.room_id)
+    room_name, room_alias = await get_room_info(meetbot.client, event.room_id)
 
     meetbot.log.info(f"Ansible: Meeting started in {room_name} ({room_alias} / {event.room_id})")
     meetbot.log.info(f'Will post to Discourse as {config(meetbot)["discourse_user"]}')
 
 
+def minutes_vars(export):
+    return {
+        "items": export.items,
+        "actions": export.actions,
+        "first": export.first,
+        "last": export.last,
+        "people_present": export.people_present,
+    }
+
+
+async def minutes(meetbot, meeting, export):
+    room_name, room_alias = await get_room_info(meetbot.client, meeting["room_id"])
+    html = await render(
+        meetbot,
+        "html_minutes.j2",
+        name=meeting["meeting_name"],
+        room=room_name,
+        alias=room_alias or meeting["room_id"],
+        logs="",
+        **minutes_vars(export),
+    )
+    return None, html
+
+
 async def endmeeting(meetbot, event, meeting):
-    room_alias = await get_room_alias(meetbot.client, event.room_id)
-    room_name = await get_room_name(meetbot.client, event.room_id)
-    items = await meetbot.get_items(meeting["meeting_id"])
-    people_present = await meetbot.get_people_present(meeting["meeting_id"])
+    room_name, room_alias = await get_room_info(meetbot.client, event.room_id)
+    export = await meetbot.export(meeting["meeting_id"])
 
     meetbot.log.info(f"Ansible: Meeting ended in {room_name} ({room_alias} / {event.room_id})")
 
-    if len(items) == 0:
+    if export.first is None:
         meetbot.log.info("No entries")
         await event.respond("No logs to post to Discourse")
         return ()
 
     # Upload full_log to Discourse
-    log_path = await upload_log_to_discourse(
-        config(meetbot), render(meetbot, "text_log.j2", items=items), meetbot.log
-    )
+    with meetbot.metrics.span(meetbot.metrics.backend_seconds, backend="ansible", phase="log"):
+        items = meetbot.iter_items(meeting["meeting_id"])
+        log_data = await render(meetbot, "text_log.j2", items=items)
+        log_path = await upload_log_to_discourse(
+            meetbot.http, config(meetbot), log_data, meetbot.log
+        )
     meetbot.log.info(f"Discourse Log URL: {log_path}")
 
-    minutes = (
-        render(
-            meetbot,
-            "html_minutes.j2",
-            items=items,
-            name=meeting["meeting_name"],
-            room=room_name,
-            alias=room_alias,
-            people_present=people_present,
-            logs=log_path,
-        ),
+    minutes = await render(
+        meetbot,
+        "html_minutes.j2",
+        name=meeting["meeting_name"],
+        room=room_name,
+        alias=room_alias,
+        logs=log_path,
+        **minutes_vars(export),
     )
     meetbot.log.info(f"Discourse Log URL: {minutes}")
-    title = f"Meeting Log | {room_name} | { time_from_timestamp(int(items[0]['timestamp'])) }"
-
-    pid = await post_to_discourse(config(meetbot), minutes, title, meetbot.log)
-    if pid != "":
-        url = config(meetbot)["discourse_url"] + "/t/" + str(pid)
-        await event.respond(f"Logs [posted to Discourse]({url})")
+    title = f"Meeting Log | {room_name} | {export.first.datetime}"
+
+    # Only a post that certainly wasn't made is left for the job queue to try again. The others
+    # are reported to the room, and finish the job so the minutes are never posted twice
+    rerender = f"`!rerender {meeting['meeting_id']}`"
+    try:
+        with meetbot.metrics.span(meetbot.metrics.backend_seconds, backend="ansible", phase="post"):
+            pid = await post_to_discourse(
+                meetbot.http, config(meetbot), minutes, title, meetbot.log
+            )
+    except DiscourseRejected as e:
+        meetbot.log.error(f"Discourse rejected the minutes: {e}")
+        await event.respond(
+            f"Discourse rejected the minutes, so they weren't posted. Once that's fixed, "
+            f"{rerender} posts them"
+        )
+        return
+    except DiscourseUncertain as e:
+        meetbot.log.warning(f"Posting the minutes to Discourse may have failed: {e}")
+        await event.respond(
+            f"Posting the minutes to Discourse failed part way, so they may not have been "
+            f"posted. If they're missing, {rerender} posts them again"
+        )
+        return
+    url = config(meetbot)["discourse_url"] + "/t/" + str(pid)
+    await event.respond(f"Logs [posted to Discourse]({url})")
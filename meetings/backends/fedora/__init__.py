@@ -1,64 +1,105 @@
+import asyncio
+import contextlib
 import json
 import os
 import re
+import tempfile
+import time
 
-import httpx
-import jinja2
-from fedora_messaging import api as fm_api
-from fedora_messaging import exceptions as fm_exceptions
-from httpx_gssapi import HTTPSPNEGOAuth
-from meetbot_messages import MeetingCompleteV1, MeetingStartV1
-from slugify import slugify
-
+from ...startup import LazyModule
 from ...util import get_room_alias, time_from_timestamp
+from .. import load_templates
+from .publisher import Publisher
 
+# These take a while to import, and most reloads of the plugin never need them
+httpx = LazyModule("httpx")
+httpx_gssapi = LazyModule("httpx_gssapi")
+meetbot_messages = LazyModule("meetbot_messages")
+slugify = LazyModule("slugify")
+
+TEMPLATES = ["text_log.j2", "html_log.j2", "text_minutes.j2", "html_minutes.j2"]
+# These templates contain every line of the meeting, so they are streamed rather than rendered
+LOG_TEMPLATES = ["text_log.j2", "html_log.j2"]
+# Streamed output is handed to the writer thread in pieces of about this many characters
+WRITE_BUFFER_SIZE = 64 * 1024
+
+# How long FASJSON answers are remembered for, in seconds. Users rarely change the matrix
+# account in FAS, but users without one are rechecked sooner in case they add it
+FASJSON_CACHE_TTL = 7 * 24 * 60 * 60
+FASJSON_NEGATIVE_CACHE_TTL = 24 * 60 * 60
+# The most FASJSON requests to have in flight at once
+FASJSON_CONCURRENCY = 8
+
+
+async def setup(meetbot):
+    await load_templates(meetbot, "fedora", TEMPLATES)
+
+    # one client for every FASJSON lookup, so connections are kept alive between requests. It's
+    # made on the first lookup
+    meetbot.fasjson_client = None
+
+    # messages are published from the fedora_messages_outbox table in the background,
+    # starting with any that were still waiting when the plugin was last stopped
+    meetbot.fedora_publisher = Publisher(meetbot.database, meetbot.log)
+    meetbot.fedora_publisher.start()
+
+
+async def stop(meetbot):
+    await meetbot.fedora_publisher.stop()
+    if meetbot.fasjson_client:
+        await meetbot.fasjson_client.aclose()
 
-def sendfedoramessage(meetbot, message):
-    try:
-        fm_api.publish(message)
-    except fm_exceptions.PublishReturned as e:
-        meetbot.log.warn(f"Fedora Messaging broker rejected message {message.id}: {e}")
-    except fm_exceptions.ConnectionException as e:
-        meetbot.log.warn(f"Error sending message {message.id}: {e}")
-
-
-def render(meetbot, templatename, autoescape=True, **kwargs):
-    def formatdate(timestamp):
-        """timestamp to date filter"""
-        return time_from_timestamp(int(timestamp))
-
-    def formattime(timestamp):
-        """timestamp to time filter"""
-        return time_from_timestamp(int(timestamp), format="%H:%M:%S")
-
-    def removecommand(line, command=""):
-        return line.removeprefix(f"{meetbot.config['tags_command_prefix']}{command}").strip()
-
-    def getcommand(line):
-        commands = ["startmeeting", "endmeeting", "topic", "meetingname"]
-        for c in commands:
-            if line.startswith(f"!{c}"):
-                return c
-        return ""
-
-    j2env = jinja2.Environment(
-        trim_blocks=True,
-        lstrip_blocks=True,
-        autoescape=autoescape,  # noqa: S701
-    )
-    j2env.filters["formatdate"] = formatdate
-    j2env.filters["formattime"] = formattime
-    j2env.filters["removecommand"] = removecommand
-    j2env.filters["getcommand"] = getcommand
 
-    template = meetbot.loader.sync_read_file(f"meetings/backends/fedora/{templatename}")
-    return j2env.from_string(template.decode()).render(**kwargs)
+def fasjson_client(meetbot):
+    if meetbot.fasjson_client is None:
+        meetbot.fasjson_client = httpx.AsyncClient(
+            base_url=meetbot.config["backend_data"]["fedora"]["fasjson_url"],
+            auth=httpx_gssapi.HTTPSPNEGOAuth(),
+            limits=httpx.Limits(max_connections=FASJSON_CONCURRENCY),
+            timeout=30,
+        )
+    return meetbot.fasjson_client
+
+
+async def render(meetbot, templatename, **kwargs):
+    template = meetbot.j2envs["fedora"].get_template(templatename)
+    return await template.render_async(**kwargs)
 
 
-def writeToFile(path, filename, string):
-    f = open(os.path.join(path, filename), "w")
-    f.write(string)
-    f.close()
+def _writeChunks(f, chunks):
+    f.write("".join(chunks))
+
+
+async def renderToFile(meetbot, templatename, path, filename, items, **kwargs):
+    """Render a template to path/filename without blocking the event loop.
+
+    Log templates are streamed from the database, with the writes done in a worker thread.
+    The minutes are rendered in a worker thread in one go. Either way the output goes to a
+    temporary file which only replaces path/filename once it is complete.
+    """
+    template = meetbot.j2envs["fedora"].get_template(templatename)
+    fd, tmppath = await asyncio.to_thread(tempfile.mkstemp, dir=path, prefix=f".{filename}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            if templatename in LOG_TEMPLATES:
+                chunks, size = [], 0
+                async for chunk in template.generate_async(items=items, **kwargs):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= WRITE_BUFFER_SIZE:
+                        await asyncio.to_thread(_writeChunks, f, chunks)
+                        chunks, size = [], 0
+                await asyncio.to_thread(_writeChunks, f, chunks)
+            else:
+                rendered = await asyncio.to_thread(template.render, items=items, **kwargs)
+                await asyncio.to_thread(f.write, rendered)
+        # mkstemp makes the file private, but these are published on the web
+        await asyncio.to_thread(os.chmod, tmppath, 0o644)
+        await asyncio.to_thread(os.replace, tmppath, os.path.join(path, filename))
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmppath)
+        raise
 
 
 async def _get_fasname_from_mxid(meetbot, event, mxid):
@@ -67,19 +108,27 @@ async def _get_fasname_from_mxid(meetbot, event, mxid):
         # if server is fedora.im, thats the fas username, so we all good
         return matrix_username
     else:
+        # see if we have looked this user up recently
+        dbq = "SELECT fas_name, fetched_at FROM fasjson_cache WHERE mxid = $1"
+        cached = await meetbot.database.fetchrow(dbq, mxid)
+        if cached:
+            ttl = FASJSON_CACHE_TTL if cached["fas_name"] else FASJSON_NEGATIVE_CACHE_TTL
+            if cached["fetched_at"] + ttl > time.time():
+                return cached["fas_name"] or mxid
+
         # we have to look up to see if the user has set a matrix account in FAS
         searchterm = f"matrix://{matrix_server}/{matrix_username}"
-        baseurl = meetbot.config["backend_data"]["fedora"]["fasjson_url"]
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    baseurl + "/v1/search/users/",
-                    auth=HTTPSPNEGOAuth(),
-                    params={"ircnick__exact": searchterm},
-                )
-            except httpx.HTTPError as e:
-                meetbot.log.error(f"Error Getting information from FASJSON: {e}")
-                return mxid
+        try:
+            response = await fasjson_client(meetbot).get(
+                "/v1/search/users/",
+                params={"ircnick__exact": searchterm},
+            )
+            # an error's body has no results either, but that doesn't mean there's no account,
+            # so only a successful answer is cached
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            meetbot.log.error(f"Error Getting information from FASJSON: {e}")
+            return mxid
         try:
             searchresult = response.json().get("result", [])
         except json.decoder.JSONDecodeError as e:
@@ -93,18 +142,55 @@ async def _get_fasname_from_mxid(meetbot, event, mxid):
                 f"Accounts ({[u['username'] for u in searchresult]}). Defaulting "
                 f"to using {user} in Fedora Messaging messages"
             )
-            return user
         elif len(searchresult) == 0:
-            return mxid
+            user = None
         else:
-            return searchresult[0]["username"]
+            user = searchresult[0]["username"]
+
+        dbq = (
+            "INSERT INTO fasjson_cache (mxid, fas_name, fetched_at) VALUES ($1, $2, $3) "
+            "ON CONFLICT (mxid) DO UPDATE SET fas_name = excluded.fas_name, "
+            "fetched_at = excluded.fetched_at"
+        )
+        await meetbot.database.execute(dbq, mxid, user, int(time.time()))
+        return user or mxid
+
+
+async def _get_fasnames_from_mxids(meetbot, event, mxids):
+    """Look up several mxids at once, with at most FASJSON_CONCURRENCY requests in flight"""
+    semaphore = asyncio.Semaphore(FASJSON_CONCURRENCY)
+
+    async def lookup(mxid):
+        async with semaphore:
+            return mxid, await _get_fasname_from_mxid(meetbot, event, mxid)
+
+    return dict(await asyncio.gather(*(lookup(mxid) for mxid in set(mxids))))
+
+
+def minutes_vars(meeting, export, room):
+    return {
+        "actions": export.actions,
+        "first": export.first,
+        "last": export.last,
+        "room": room,
+        "people_present": export.people_present,
+        "meeting_name": meeting["meeting_name"],
+    }
+
+
+async def minutes(meetbot, meeting, export):
+    room_alias = await get_room_alias(meetbot.client, meeting["room_id"])
+    template_vars = minutes_vars(meeting, export, room_alias or meeting["room_id"])
+    text = await render(meetbot, "text_minutes.j2", items=export.items, **template_vars)
+    html = await render(meetbot, "html_minutes.j2", items=export.items, **template_vars)
+    return text, html
 
 
 async def startmeeting(meetbot, event, meeting):
     room_alias = await get_room_alias(meetbot.client, event.room_id)
     start_user = await _get_fasname_from_mxid(meetbot, event, event.sender)
     if meetbot.config["backend_data"]["fedora"].get("send_fedoramessages", True):
-        message = MeetingStartV1(
+        message = meetbot_messages.MeetingStartV1(
             body={
                 "start_time": time_from_timestamp(event.timestamp, format="%Y-%m-%dT%H:%M:%S+1000"),
                 "start_user": start_user,
@@ -112,7 +198,7 @@ async def startmeeting(meetbot, event, meeting):
                 "meeting_name": meeting["meeting_name"],
             }
         )
-        sendfedoramessage(meetbot, message)
+        await meetbot.fedora_publisher.enqueue(message)
         meetbot.log.info(f"Fedora: Meeting started in {room_alias}")
 
 
@@ -121,24 +207,19 @@ async def endmeeting(meetbot, event, meeting):
     room_alias = await get_room_alias(meetbot.client, event.room_id)
     if not room_alias:
         room_alias = event.room_id
-    items = await meetbot.get_items(meeting["meeting_id"])
-    people_present = await meetbot.get_people_present(meeting["meeting_id"])
-    starttime = time_from_timestamp(items[0]["timestamp"], format="%Y-%m-%d-%H.%M")
-    startdate = time_from_timestamp(items[0]["timestamp"], format="%Y-%m-%d")
-    filename = f"{slugify(meeting['meeting_name'])}.{starttime}"
+    export = await meetbot.export(meeting["meeting_id"])
+    first = export.first
+    starttime = time_from_timestamp(first["timestamp"], format="%Y-%m-%d-%H.%M")
+    startdate = time_from_timestamp(first["timestamp"], format="%Y-%m-%d")
+    filename = f"{slugify.slugify(meeting['meeting_name'])}.{starttime}"
     # makes a slugified room alias e.g. `#fedora-meeting:fedora.im`
     # becomes `fedora-meeting_matrix-fedora-im`
-    slugified_room_alias = slugify(
+    slugified_room_alias = slugify.slugify(
         room_alias, replacements=[[":", "_matrix_"]], regex_pattern=r"[^-a-z0-9_]+"
     )
     url = f"{config['logs_baseurl']}{slugified_room_alias}/{startdate}/"
 
-    template_vars = {
-        "items": items,
-        "room": room_alias,
-        "people_present": people_present,
-        "meeting_name": meeting["meeting_name"],
-    }
+    template_vars = minutes_vars(meeting, export, room_alias)
 
     templates = [
         ("text_log.j2", f"{filename}.log.txt", "Text Log"),
@@ -147,53 +228,61 @@ async def endmeeting(meetbot, event, meeting):
         ("html_minutes.j2", f"{filename}.html", "HTML Minutes"),
     ]
 
-    # TODO: chairs aren't implemented in the main part of meetings yet, so just use the
-    # user that started the meetings for now
-    chairs = [items[0]["sender"]]
+    chairs = [export.chair]
 
     # create the directories if they don't exist will look something like
     # /meetbot_logs/web/meetbot/fedora-meeting-1_matrix-fedora-im/2023-09-01/
     path = os.path.join(config["logs_directory"], slugified_room_alias, startdate)
-    if not os.access(path, os.F_OK):
-        try:
-            os.makedirs(path)
-        except OSError as e:
-            meetbot.log.error(f"Creating Directories failed with error: {e}")
+    try:
+        await asyncio.to_thread(os.makedirs, path, exist_ok=True)
+    except OSError as e:
+        meetbot.log.error(f"Creating Directories failed with error: {e}")
 
-    # we build this up as a cache of {"@mxid:server.test": "fasname"} pairs, or if we can't find
-    # a fas username, just use the mxid. I'm doing this seperately to reduce dupilcate calls to
-    # FASJSON
-    fasnames = {}
+    # {"@mxid:server.test": "fasname"} pairs for everyone we need, or if we can't find a fas
+    # username, just the mxid
+    with meetbot.metrics.span(meetbot.metrics.backend_seconds, backend="fedora", phase="fasjson"):
+        fasnames = await _get_fasnames_from_mxids(
+            meetbot, event, [*export.counts, *chairs, event.sender]
+        )
 
     attendees = []
-    for person in people_present:
+    for person in export.people_present:
         mxid = person["sender"]
-        fasnames[mxid] = await _get_fasname_from_mxid(meetbot, event, mxid)
-        attendees.append({"name": fasnames[mxid], "lines_said": int(person["count"])})
+        attendees.append({"name": fasnames[mxid], "lines_said": person["count"]})
 
-    for mxid in chairs:
-        if mxid not in fasnames.keys():
-            fasnames[mxid] = await _get_fasname_from_mxid(meetbot, event, mxid)
+    def items_for(template):
+        if template in LOG_TEMPLATES:
+            return meetbot.iter_items(meeting["meeting_id"])
+        # the minutes only ever look at the tagged lines
+        return export.items
 
-    for template, file, label in templates:
-        autoescape = True if file.endswith((".html", ".htm", ".xml")) else False
-        rendered = render(meetbot, template, autoescape=autoescape, **template_vars)
-        try:
-            writeToFile(path, file, rendered)
-        except OSError as e:
+    # all four files are rendered and written at the same time, then reported in order
+    with meetbot.metrics.span(meetbot.metrics.backend_seconds, backend="fedora", phase="write"):
+        results = await asyncio.gather(
+            *(
+                renderToFile(meetbot, template, path, file, items_for(template), **template_vars)
+                for template, file, label in templates
+            ),
+            return_exceptions=True,
+        )
+    for (template, file, label), result in zip(templates, results, strict=True):
+        if isinstance(result, OSError):
             await event.respond(f"Issue Saving {file}. Uploading here instead")
-            meetbot.log.error(f"Saving File failed with error: {e}")
+            meetbot.log.error(f"Saving File failed with error: {result}")
+            rendered = await render(meetbot, template, items=items_for(template), **template_vars)
             await meetbot.upload_file(event, file, rendered)
+        elif isinstance(result, BaseException):
+            raise result
         else:
             await event.respond(f"{label}: {url}{file}")
 
     if meetbot.config["backend_data"]["fedora"].get("send_fedoramessages", True):
-        message = MeetingCompleteV1(
+        message = meetbot_messages.MeetingCompleteV1(
             body={
                 "start_time": time_from_timestamp(
-                    items[0]["timestamp"], format="%Y-%m-%dT%H:%M:%S+1000"
+                    first["timestamp"], format="%Y-%m-%dT%H:%M:%S+1000"
                 ),
-                "start_user": fasnames[items[0]["sender"]],
+                "start_user": fasnames[first["sender"]],
                 "end_time": time_from_timestamp(event.timestamp, format="%Y-%m-%dT%H:%M:%S+1000"),
                 "end_user": fasnames.get(event.sender, event.sender),
                 "location": room_alias,
@@ -204,10 +293,6 @@ async def endmeeting(meetbot, event, meeting):
                 "logs": [{"log_type": lt, "log_url": f"{url}{f}"} for t, f, lt in templates],
             }
         )
-        # TODO: Make this async
-        try:
-            sendfedoramessage(meetbot, message)
-        except Exception as e:
-            meetbot.log.error(e)
+        await meetbot.fedora_publisher.enqueue(message)
 
     meetbot.log.info(f"Fedora: Meeting ended in {room_alias}")
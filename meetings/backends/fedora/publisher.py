@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from ...startup import LazyModule
+from ...worker import Worker
+
+# fedora-messaging pulls in twisted, so it's only imported once there's a message to publish
+fm_api = LazyModule("fedora_messaging.api")
+fm_exceptions = LazyModule("fedora_messaging.exceptions")
+fm_message = LazyModule("fedora_messaging.message")
+
+# Failed publishes are retried with exponential backoff, starting at PUBLISH_BACKOFF seconds
+# and capped at PUBLISH_MAX_BACKOFF, until PUBLISH_RETRIES attempts have been made
+PUBLISH_RETRIES = 20
+PUBLISH_BACKOFF = 30
+PUBLISH_MAX_BACKOFF = 60 * 60
+
+
+class Publisher(Worker):
+    """Publishes Fedora Messaging messages in the background, through a database outbox.
+
+    ``enqueue`` only writes the message to the ``fedora_messages_outbox`` table. A background
+    task publishes it from a worker thread and removes it once the broker has it, so meeting
+    handlers never wait on AMQP, and messages waiting for a retry survive a restart.
+    """
+
+    doing = "publishing Fedora Messaging messages"
+    error_delay = PUBLISH_BACKOFF
+
+    def __init__(self, database, log):
+        super().__init__(log)
+        self.database = database
+
+    async def enqueue(self, message):
+        dbq = "INSERT INTO fedora_messages_outbox (message_id, message) VALUES ($1, $2)"
+        await self.database.execute(dbq, message.id, fm_message.dumps(message))
+        self.wakeup.set()
+
+    async def run_once(self):
+        return await self.publish_due()
+
+    async def publish_due(self):
+        """Publish every message that is due, returning the seconds until the next one is"""
+        now = int(time.time())
+        dbq = (
+            "SELECT * FROM fedora_messages_outbox WHERE next_attempt <= $1 "
+            "ORDER BY next_attempt, message_id"
+        )
+        for row in await self.database.fetch(dbq, now):
+            # one message going wrong mustn't hold up the ones after it
+            try:
+                await self.publish(row)
+            except Exception as e:
+                self.log.exception(f"Error publishing message {row['message_id']}: {e}")
+
+        dbq = "SELECT MIN(next_attempt) FROM fedora_messages_outbox"
+        next_attempt = await self.database.fetchval(dbq)
+        if next_attempt is None:
+            return None
+        return max(next_attempt - time.time(), 0)
+
+    async def publish(self, row):
+        try:
+            message = fm_message.loads(row["message"])[0]
+        except Exception as e:
+            # this message can never be published, so drop it rather than retrying it forever
+            self.log.error(f"Dropping unreadable message {row['message_id']}: {e}")
+            await self.delete(row)
+            return
+        try:
+            await asyncio.to_thread(fm_api.publish, message)
+        except fm_exceptions.PublishReturned as e:
+            # the broker has looked at the message and refused it, trying again won't help
+            self.log.warning(f"Fedora Messaging broker rejected message {message.id}: {e}")
+        except fm_exceptions.ValidationError as e:
+            # nor will sending a message that doesn't match its schema again
+            self.log.error(f"Dropping invalid message {message.id}: {e}")
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            if attempts < PUBLISH_RETRIES:
+                backoff = min(PUBLISH_BACKOFF * 2 ** (attempts - 1), PUBLISH_MAX_BACKOFF)
+                self.log.warning(f"Error sending message {message.id}, retrying in {backoff}s: {e}")
+                dbq = (
+                    "UPDATE fedora_messages_outbox SET attempts = $2, next_attempt = $3 "
+                    "WHERE message_id = $1"
+                )
+                await self.database.execute(
+                    dbq, row["message_id"], attempts, int(time.time()) + backoff
+                )
+                return
+            self.log.error(f"Giving up on message {message.id} after {attempts} attempts: {e}")
+
+        await self.delete(row)
+
+    async def delete(self, row):
+        dbq = "DELETE FROM fedora_messages_outbox WHERE message_id = $1"
+        await self.database.execute(dbq, row["message_id"])
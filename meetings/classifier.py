@@ -0,0 +1,65 @@
+from typing import NamedTuple
+
+# Short forms of commands, mapped to the command they stand for
+COMMAND_ALIASES = {
+    "t": "topic",
+    "mn": "meetingname",
+    "sm": "startmeeting",
+    "em": "endmeeting",
+}
+
+
+class Classified(NamedTuple):
+    command: str | None
+    argument: str
+    tag: str | None
+    tag_text: str
+
+
+class LineClassifier:
+    """Works out the command and tag of a line of a message in one pass over it.
+
+    A command is a line starting with ``!``, with everything after the command's name being its
+    argument. Commands are looked up in ``commands`` (after resolving aliases), so unknown ones
+    come back as None. A tag is the prefix followed by one of ``tags`` as a whole word, either at
+    the start of the line or, without ``at_start``, its last occurrence anywhere in the line.
+    ``tag_text`` is what follows the tag. Tags are found by looking words up in a set, so the
+    cost depends on the length of the line, not on how many tags there are.
+    """
+
+    def __init__(self, tags, prefix="^", at_start=True, commands=()):
+        self.tags = frozenset(tags)
+        self.prefix = prefix
+        self.at_start = at_start
+        self.commands = {command: command for command in commands}
+        self.commands.update(
+            {alias: command for alias, command in COMMAND_ALIASES.items() if command in commands}
+        )
+
+    def __call__(self, line):
+        command, argument = self.command(line)
+        tag, tag_text = self.tag(line)
+        return Classified(command, argument, tag, tag_text)
+
+    def command(self, line):
+        if len(line) < 2 or line[0] != "!" or line[1].isspace():
+            return None, ""
+        name, *argument = line[1:].split(maxsplit=1)
+        return self.commands.get(name), argument[0] if argument else ""
+
+    def tag(self, line):
+        if self.at_start:
+            if not line.startswith(self.prefix):
+                return None, ""
+            word, space, rest = line[len(self.prefix) :].partition(" ")
+            return (word, space + rest) if word in self.tags else (None, "")
+
+        # Walk the words from the end of the line, as the last tag wins
+        end = len(line)
+        while end >= 0:
+            start = line.rfind(" ", 0, end) + 1
+            _, prefix, word = line[start:end].rpartition(self.prefix)
+            if prefix and word in self.tags:
+                return word, line[end:]
+            end = start - 1
+        return None, ""
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
-from mautrix.util.async_db import Connection, UpgradeTable
+from mautrix.util.async_db import Connection, Scheme
 
-upgrade_table = UpgradeTable()
+from .archive import decompress_logs
+from .startup import TimedUpgradeTable
+
+upgrade_table = TimedUpgradeTable()
 
 
 @upgrade_table.register(description="Initial revision")
@@ -45,3 +48,195 @@ async def upgrade_v5(conn: Connection) -> None:
     await conn.execute("ALTER TABLE meeting_logs ADD COLUMN line_num integer NOT NULL DEFAULT 0")
     await conn.execute("UPDATE meeting_logs SET line_num = COALESCE(line_num_old, 0)")
     await conn.execute("ALTER TABLE meeting_logs DROP COLUMN line_num_old")
+
+
+# Timestamps were stored as text, which sorts wrongly and can't be range-scanned, and nothing
+# was indexed so every per-meeting query scanned the logs of every other meeting too
+@upgrade_table.register(description="store timestamps as integers and index meeting_logs")
+async def upgrade_v6(conn: Connection, scheme: Scheme) -> None:
+    if scheme == Scheme.SQLITE:
+        # SQLite can't change the type of a column, so rebuild the table with the same layout
+        await conn.execute("""CREATE TABLE meeting_logs_new (
+             meeting_id TEXT NOT NULL,
+             timestamp BIGINT NOT NULL,
+             sender TEXT NOT NULL,
+             message TEXT NOT NULL,
+             tag TEXT DEFAULT NULL,
+             topic TEXT DEFAULT '',
+             line_num integer NOT NULL DEFAULT 0
+        )""")
+        await conn.execute(
+            "INSERT INTO meeting_logs_new "
+            "SELECT meeting_id, CAST(timestamp AS INTEGER), sender, message, tag, topic, line_num "
+            "FROM meeting_logs"
+        )
+        await conn.execute("DROP TABLE meeting_logs")
+        await conn.execute("ALTER TABLE meeting_logs_new RENAME TO meeting_logs")
+    else:
+        await conn.execute(
+            "ALTER TABLE meeting_logs ALTER COLUMN timestamp TYPE BIGINT USING timestamp::BIGINT"
+        )
+    await conn.execute(
+        "CREATE INDEX meeting_logs_meeting_idx ON meeting_logs (meeting_id, timestamp, line_num)"
+    )
+    await conn.execute(
+        "CREATE INDEX meeting_logs_tagged_idx ON meeting_logs (meeting_id, timestamp, line_num) "
+        "WHERE tag IS NOT NULL"
+    )
+
+
+@upgrade_table.register(description="add fasjson_cache")
+async def upgrade_v7(conn: Connection) -> None:
+    # A NULL fas_name records that FASJSON had no account for the mxid
+    await conn.execute("""CREATE TABLE fasjson_cache (
+         mxid TEXT PRIMARY KEY,
+         fas_name TEXT DEFAULT NULL,
+         fetched_at BIGINT NOT NULL
+    )""")
+
+
+@upgrade_table.register(description="add fedora_messages_outbox")
+async def upgrade_v8(conn: Connection) -> None:
+    # Fedora Messaging messages waiting to be published, serialised with fedora_messaging.dumps
+    await conn.execute("""CREATE TABLE fedora_messages_outbox (
+         message_id TEXT PRIMARY KEY,
+         message TEXT NOT NULL,
+         attempts INTEGER NOT NULL DEFAULT 0,
+         next_attempt BIGINT NOT NULL DEFAULT 0
+    )""")
+
+
+@upgrade_table.register(description="add meeting_jobs")
+async def upgrade_v9(conn: Connection) -> None:
+    # Finished meetings waiting for their backend processing. event is the serialised
+    # !endmeeting event, which the backends reply to
+    await conn.execute("""CREATE TABLE meeting_jobs (
+         meeting_id TEXT PRIMARY KEY,
+         room_id TEXT NOT NULL,
+         meeting_name TEXT NOT NULL,
+         topic TEXT DEFAULT '',
+         event TEXT NOT NULL,
+         attempts INTEGER NOT NULL DEFAULT 0,
+         next_attempt BIGINT NOT NULL DEFAULT 0
+    )""")
+
+
+@upgrade_table.register(description="add meeting_attendance")
+async def upgrade_v10(conn: Connection) -> None:
+    # Lines said per sender, kept up to date as lines are logged so the minutes don't need to
+    # count the whole log
+    await conn.execute("""CREATE TABLE meeting_attendance (
+         meeting_id TEXT NOT NULL,
+         sender TEXT NOT NULL,
+         lines INTEGER NOT NULL DEFAULT 0,
+         PRIMARY KEY (meeting_id, sender)
+    )""")
+    await conn.execute(
+        "INSERT INTO meeting_attendance (meeting_id, sender, lines) "
+        "SELECT meeting_id, sender, COUNT(*) FROM meeting_logs GROUP BY meeting_id, sender"
+    )
+
+
+@upgrade_table.register(description="add meeting_archive")
+async def upgrade_v11(conn: Connection, scheme: Scheme) -> None:
+    # Finished meetings, one row each, with their logs compressed into a single blob
+    blob = "BLOB" if scheme == Scheme.SQLITE else "BYTEA"
+    await conn.execute(f"""CREATE TABLE meeting_archive (
+         meeting_id TEXT PRIMARY KEY,
+         room_id TEXT NOT NULL,
+         meeting_name TEXT NOT NULL,
+         topic TEXT DEFAULT '',
+         started BIGINT,
+         ended BIGINT,
+         lines INTEGER NOT NULL DEFAULT 0,
+         archived_at BIGINT NOT NULL,
+         logs {blob} NOT NULL
+    )""")
+    await conn.execute(
+        "CREATE INDEX meeting_archive_room_idx ON meeting_archive (room_id, started)"
+    )
+    await conn.execute("CREATE INDEX meeting_archive_archived_idx ON meeting_archive (archived_at)")
+
+
+@upgrade_table.register(description="add meeting_search")
+async def upgrade_v12(conn: Connection, scheme: Scheme) -> None:
+    # Full-text index over the lines of archived meetings
+    if scheme == Scheme.SQLITE:
+        await conn.execute("""CREATE VIRTUAL TABLE meeting_search USING fts5(
+             message,
+             meeting_id UNINDEXED,
+             timestamp UNINDEXED,
+             topic UNINDEXED
+        )""")
+    else:
+        await conn.execute("""CREATE TABLE meeting_search (
+             message TEXT NOT NULL,
+             meeting_id TEXT NOT NULL,
+             timestamp BIGINT NOT NULL,
+             topic TEXT DEFAULT '',
+             document tsvector GENERATED ALWAYS AS (to_tsvector('english', message)) STORED
+        )""")
+        await conn.execute(
+            "CREATE INDEX meeting_search_document_idx ON meeting_search USING GIN (document)"
+        )
+        await conn.execute("CREATE INDEX meeting_search_meeting_idx ON meeting_search (meeting_id)")
+
+    dbq = (
+        "INSERT INTO meeting_search (message, meeting_id, timestamp, topic) "
+        "VALUES ($1, $2, $3, $4)"
+    )
+    for row in await conn.fetch("SELECT meeting_id, logs FROM meeting_archive"):
+        items = decompress_logs(row["meeting_id"], row["logs"])
+        await conn.executemany(
+            dbq,
+            [
+                (item["message"], item["meeting_id"], item["timestamp"], item["topic"])
+                for item in items
+            ],
+        )
+
+
+@upgrade_table.register(description="add meeting_jobs.backends_done")
+async def upgrade_v13(conn: Connection) -> None:
+    # The backends that have finished with a meeting, as a JSON list of names, so a job that is
+    # retried only runs the backends that failed
+    await conn.execute(
+        "ALTER TABLE meeting_jobs ADD COLUMN backends_done TEXT NOT NULL DEFAULT '[]'"
+    )
+
+
+# Lines are ordered by (timestamp, sender, line_num), which two events from the same sender in
+# the same millisecond can share, so give every line a unique id to break the tie
+@upgrade_table.register(description="add meeting_logs.id")
+async def upgrade_v14(conn: Connection, scheme: Scheme) -> None:
+    if scheme == Scheme.SQLITE:
+        # SQLite can't add an autoincrementing column, so rebuild the table with one
+        await conn.execute("""CREATE TABLE meeting_logs_new (
+             meeting_id TEXT NOT NULL,
+             timestamp BIGINT NOT NULL,
+             sender TEXT NOT NULL,
+             message TEXT NOT NULL,
+             tag TEXT DEFAULT NULL,
+             topic TEXT DEFAULT '',
+             line_num integer NOT NULL DEFAULT 0,
+             id INTEGER PRIMARY KEY
+        )""")
+        await conn.execute(
+            "INSERT INTO meeting_logs_new "
+            "(meeting_id, timestamp, sender, message, tag, topic, line_num) "
+            "SELECT meeting_id, timestamp, sender, message, tag, topic, line_num "
+            "FROM meeting_logs ORDER BY rowid"
+        )
+        await conn.execute("DROP TABLE meeting_logs")
+        await conn.execute("ALTER TABLE meeting_logs_new RENAME TO meeting_logs")
+        # the indexes went with the old table
+        await conn.execute(
+            "CREATE INDEX meeting_logs_meeting_idx "
+            "ON meeting_logs (meeting_id, timestamp, line_num)"
+        )
+        await conn.execute(
+            "CREATE INDEX meeting_logs_tagged_idx "
+            "ON meeting_logs (meeting_id, timestamp, line_num) WHERE tag IS NOT NULL"
+        )
+    else:
+        await conn.execute("ALTER TABLE meeting_logs ADD COLUMN id BIGSERIAL PRIMARY KEY")
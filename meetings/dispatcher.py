@@ -0,0 +1,99 @@
+import asyncio
+import contextlib
+import json
+from collections import deque
+
+from mautrix.errors import MatrixRequestError, MLimitExceeded
+
+# Rate limited sends are tried this many times, waiting for as long as the homeserver asks or
+# with exponential backoff starting at DISPATCH_BACKOFF seconds
+DISPATCH_RETRIES = 5
+DISPATCH_BACKOFF = 1
+# How many sends and reactions can be in flight at once, across all rooms
+DISPATCH_CONCURRENCY = 16
+
+
+def retry_after(e, attempt):
+    """How long to wait before trying a rate limited request again, in seconds, or None if the
+    error isn't a rate limit"""
+    if not isinstance(e, MLimitExceeded) and getattr(e, "http_status", None) != 429:
+        return None
+    # mautrix only keeps the raw response for errors it doesn't know about
+    with contextlib.suppress(TypeError, ValueError, KeyError):
+        return json.loads(getattr(e, "text", ""))["retry_after_ms"] / 1000
+    return DISPATCH_BACKOFF * 2**attempt
+
+
+class Dispatcher:
+    """Sends the bot's feedback to rooms in the background, so logging never waits for it.
+
+    Messages to a room are sent in the order they were queued, by a worker that exits once the
+    room's queue is empty. Reactions don't need to be in order, so they are sent as soon as
+    there's room. Sends that are rate limited are tried again later; anything else that goes
+    wrong is logged and dropped. Other work that shouldn't hold up logging can be handed to
+    ``spawn``, and is waited for and cancelled along with the sends.
+    """
+
+    def __init__(self, client, log, metrics, concurrency=DISPATCH_CONCURRENCY):
+        self.client = client
+        self.log = log
+        self.metrics = metrics
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queues = {}
+        self.tasks = set()
+
+    def send(self, room_id, content):
+        """Queue a message to a room"""
+        self.metrics.sent.inc(kind="message")
+        queue = self.queues.get(room_id)
+        if queue is None:
+            queue = self.queues[room_id] = deque()
+            self.spawn(self.work(room_id, queue))
+        queue.append(content)
+
+    def react(self, room_id, event_id, emoji):
+        self.metrics.sent.inc(kind="reaction")
+        self.spawn(self.deliver(lambda: self.client.react(room_id, event_id, emoji)))
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def work(self, room_id, queue):
+        try:
+            while queue:
+                content = queue.popleft()
+                await self.deliver(lambda c=content: self.client.send_message(room_id, c))
+        finally:
+            del self.queues[room_id]
+
+    async def deliver(self, send):
+        for attempt in range(DISPATCH_RETRIES):
+            try:
+                async with self.semaphore:
+                    return await send()
+            except MatrixRequestError as e:
+                delay = retry_after(e, attempt)
+                if getattr(e, "errcode", None) == "M_DUPLICATE_ANNOTATION":
+                    return None
+                if delay is None:
+                    self.log.exception(f"Sending to a room failed: {e}")
+                    return None
+                self.log.warning(f"Rate limited, trying again in {delay}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                self.log.exception(f"Sending to a room failed: {e}")
+                return None
+        self.log.error(f"Still rate limited after {DISPATCH_RETRIES} attempts, giving up")
+        return None
+
+    async def drain(self):
+        """Wait until everything queued or spawned so far is done"""
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
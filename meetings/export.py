@@ -0,0 +1,73 @@
+class TopicSegment:
+    """A run of a meeting's lines under the same topic. ``line`` is the line that changed the
+    topic, or None for the lines before the first topic, and ``items`` the tagged lines in it"""
+
+    __slots__ = ("items", "line", "lines", "topic")
+
+    def __init__(self, topic, line):
+        self.topic = topic
+        self.line = line
+        self.items = []
+        self.lines = 0
+
+
+class MeetingExport:
+    """Everything the backends render about a meeting, gathered in one pass over its log.
+
+    Lines are passed to ``add`` in log order. Only the tagged lines are kept, along with the
+    first and last lines, so the full log can still be streamed into the templates that need
+    every line.
+    """
+
+    __slots__ = ("actions", "chair", "counts", "first", "items", "last", "meeting_id", "topics")
+
+    def __init__(self, meeting_id):
+        self.meeting_id = meeting_id
+        self.first = None
+        self.last = None
+        self.chair = None
+        self.items = []
+        self.actions = []
+        self.topics = []
+        self.counts = {}
+
+    @classmethod
+    def from_tagged(cls, meeting_id, items, first, last, people_present):
+        """An export of a meeting in progress, from its tagged lines, its first and last lines
+        and its ``meeting_attendance`` rows, rather than a pass over the whole log. That is
+        enough for the minutes, but the topic segments are left empty"""
+        export = cls(meeting_id)
+        export.first = first
+        export.last = last
+        export.chair = first.sender if first else None
+        export.items = list(items)
+        export.actions = [line for line in export.items if line.tag == "action"]
+        export.counts = {row["sender"]: row["count"] for row in people_present}
+        return export
+
+    def add(self, line):
+        if self.first is None:
+            # the !startmeeting line, so whoever sent it is chairing
+            self.first = line
+            self.chair = line.sender
+        self.last = line
+        self.counts[line.sender] = self.counts.get(line.sender, 0) + 1
+
+        if not self.topics or line.topic != self.topics[-1].topic:
+            self.topics.append(TopicSegment(line.topic, line if line.tag == "topic" else None))
+        segment = self.topics[-1]
+        segment.lines += 1
+        if line.tag:
+            self.items.append(line)
+            if line.tag != "topic":
+                segment.items.append(line)
+            if line.tag == "action":
+                self.actions.append(line)
+
+    @property
+    def people_present(self):
+        """Line counts like the ``meeting_attendance`` rows, fewest lines first"""
+        return [
+            {"sender": sender, "count": count}
+            for sender, count in sorted(self.counts.items(), key=lambda person: person[1])
+        ]
@@ -0,0 +1,86 @@
+import asyncio
+import contextlib
+
+# Events waiting in a room before the next one has to wait for space, and how many events
+# (from different rooms) are processed at once
+INGEST_ROOM_QUEUE_SIZE = 100
+INGEST_CONCURRENCY = 16
+
+
+class IngestQueue:
+    """Processes the message events of each room one at a time, in the order they arrived.
+
+    Each room with events waiting gets a worker, which exits once the room's queue is empty, so
+    idle rooms cost nothing. Workers take turns at ``concurrency`` slots, one event at a time,
+    so a busy room can't starve the others. A room can have ``room_queue_size`` events waiting;
+    after that, ``submit`` waits for space before queueing the event.
+    """
+
+    def __init__(self, process, concurrency=INGEST_CONCURRENCY, room_queue_size=None):
+        self.process = process
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.room_queue_size = room_queue_size or INGEST_ROOM_QUEUE_SIZE
+        self.queues = {}
+        self.submitters = {}
+        self.workers = {}
+
+    def busy(self, room_id):
+        """Whether a room has events that are queued or being processed"""
+        return room_id in self.submitters
+
+    def queued(self):
+        return sum(queue.qsize() for queue in self.queues.values())
+
+    async def submit(self, room_id, evt):
+        """Queue an event and wait for it to be processed, returning what ``process`` did"""
+        # the queue stays around for as long as anyone is submitting to it, so an event
+        # waiting for space can't end up in a queue that was dropped in the meantime
+        queue = self.queues.get(room_id)
+        if queue is None:
+            queue = self.queues[room_id] = asyncio.Queue(self.room_queue_size)
+        self.submitters[room_id] = self.submitters.get(room_id, 0) + 1
+        try:
+            future = asyncio.get_running_loop().create_future()
+            await queue.put((evt, future))
+            if room_id not in self.workers:
+                self.workers[room_id] = asyncio.create_task(self.work(room_id, queue))
+            return await future
+        finally:
+            self.submitters[room_id] -= 1
+            if not self.submitters[room_id]:
+                del self.submitters[room_id]
+                del self.queues[room_id]
+
+    async def work(self, room_id, queue):
+        future = None
+        try:
+            while not queue.empty():
+                evt, future = queue.get_nowait()
+                if future.done():
+                    continue
+                async with self.semaphore:
+                    try:
+                        result = await self.process(evt)
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+        except asyncio.CancelledError:
+            # nothing will process what's left, so don't leave anyone waiting for it
+            if future:
+                future.cancel()
+            while not queue.empty():
+                queue.get_nowait()[1].cancel()
+            raise
+        finally:
+            del self.workers[room_id]
+
+    async def stop(self):
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.cancel()
+        for worker in workers:
+            with contextlib.suppress(asyncio.CancelledError):
+                await worker
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import time
+
+from maubot.matrix import MaubotMessageEvent
+from mautrix.types import MessageEvent
+
+from .backends import fan_out
+from .worker import Worker
+
+# Failed jobs are retried with exponential backoff, starting at JOB_BACKOFF seconds, until
+# JOB_RETRIES attempts have been made. After that the job and its logs are left in the database
+JOB_RETRIES = 5
+JOB_BACKOFF = 60
+
+
+class BackendsFailed(Exception):
+    """Some of the backends failed to process a meeting, named in the message"""
+
+
+class JobQueue(Worker):
+    """Runs the backend processing of finished meetings in the background.
+
+    Ending a meeting records it in the ``meeting_jobs`` table along with the ``!endmeeting``
+    event, and its logs stay in ``meeting_logs`` until every backend has finished with them, when
+    they move to the archive. Jobs that were still waiting when the plugin stopped are picked up
+    again when it starts.
+    """
+
+    doing = "running meeting jobs"
+    error_delay = JOB_BACKOFF
+
+    def __init__(self, meetbot):
+        super().__init__(meetbot.log)
+        self.meetbot = meetbot
+        self.database = meetbot.database
+        self.lock = asyncio.Lock()
+
+    async def add(self, conn, evt, meeting):
+        """Queue a finished meeting, as part of the transaction on ``conn`` that ends it"""
+        dbq = (
+            "INSERT INTO meeting_jobs (meeting_id, room_id, meeting_name, topic, event) "
+            "VALUES ($1, $2, $3, $4, $5)"
+        )
+        await conn.execute(
+            dbq,
+            meeting["meeting_id"],
+            meeting["room_id"],
+            meeting["meeting_name"],
+            meeting["topic"],
+            json.dumps(evt.serialize()),
+        )
+
+    async def is_queued(self, meeting_id):
+        dbq = "SELECT 1 FROM meeting_jobs WHERE meeting_id = $1"
+        return await self.database.fetchval(dbq, meeting_id) is not None
+
+    async def run_once(self):
+        return await self.run_due()
+
+    async def run_due(self):
+        """Run every job that is due, returning the seconds until the next one is"""
+        async with self.lock:
+            dbq = (
+                "SELECT * FROM meeting_jobs WHERE attempts < $1 AND next_attempt <= $2 "
+                "ORDER BY next_attempt, meeting_id"
+            )
+            for job in await self.database.fetch(dbq, JOB_RETRIES, int(time.time())):
+                # run_job handles its own failures, this is in case recording one fails too. Either
+                # way, the jobs after it still run
+                try:
+                    await self.run_job(job)
+                except Exception as e:
+                    self.meetbot.log.exception(f"Error running job {job['meeting_id']}: {e}")
+
+            dbq = "SELECT MIN(next_attempt) FROM meeting_jobs WHERE attempts < $1"
+            next_attempt = await self.database.fetchval(dbq, JOB_RETRIES)
+        if next_attempt is None:
+            return None
+        return max(next_attempt - time.time(), 0)
+
+    async def run_job(self, job):
+        try:
+            await self.process(job)
+        except Exception as e:
+            await self.retry_later(job, e)
+
+    async def process(self, job):
+        meetbot = self.meetbot
+        evt = MaubotMessageEvent(MessageEvent.deserialize(json.loads(job["event"])), meetbot.client)
+        meeting = {
+            "room_id": job["room_id"],
+            "meeting_id": job["meeting_id"],
+            "topic": job["topic"],
+            "meeting_name": job["meeting_name"],
+        }
+
+        # Every backend that hasn't finished with the meeting yet runs at once, and only the
+        # ones that fail are tried again. The ones that succeed are recorded straight away, so
+        # nothing that goes wrong later can have them run twice
+        done = json.loads(job["backends_done"])
+        backends = [backend for backend in meetbot.backends if backend.name not in done]
+        failed = await fan_out(meetbot, backends, "endmeeting", evt, meeting)
+        if len(failed) < len(backends):
+            done += [backend.name for backend in backends if backend not in failed]
+            dbq = "UPDATE meeting_jobs SET backends_done = $2 WHERE meeting_id = $1"
+            await self.database.execute(dbq, job["meeting_id"], json.dumps(done))
+        if failed:
+            raise BackendsFailed(", ".join(backend.name for backend in failed))
+
+        # The backends are done with the meeting, so archive the logs
+        async with self.database.acquire() as conn, conn.transaction():
+            await meetbot.archive.add(conn, meeting)
+            await conn.execute("DELETE FROM meeting_jobs WHERE meeting_id = $1", job["meeting_id"])
+
+    async def retry_later(self, job, e):
+        attempts = job["attempts"] + 1
+        backoff = JOB_BACKOFF * 2 ** (attempts - 1)
+        # the backends' errors have been logged already
+        log = (
+            self.meetbot.log.error if isinstance(e, BackendsFailed) else self.meetbot.log.exception
+        )
+        if attempts < JOB_RETRIES:
+            log(f"Processing meeting {job['meeting_id']} failed, retrying in {backoff}s: {e}")
+        else:
+            log(
+                f"Processing meeting {job['meeting_id']} failed {attempts} times, giving up. "
+                f"Its logs have been kept: {e}"
+            )
+        dbq = "UPDATE meeting_jobs SET attempts = $2, next_attempt = $3 WHERE meeting_id = $1"
+        await self.database.execute(dbq, job["meeting_id"], attempts, int(time.time()) + backoff)
@@ -0,0 +1,74 @@
+import functools
+from datetime import datetime
+
+# Commands that the log templates style differently
+LOG_COMMANDS = ("startmeeting", "endmeeting", "topic", "meetingname")
+
+
+@functools.lru_cache(maxsize=4096)
+def format_second(second):
+    """(datetime, time) strings for a second. Lines tend to come in bursts within the same
+    second, and a multi-line message shares one timestamp, so most lookups are cached"""
+    moment = datetime.fromtimestamp(second)
+    return moment.strftime("%Y-%m-%d %H:%M:%S"), moment.strftime("%H:%M:%S")
+
+
+class LogLine:
+    """A line of a meeting's log, parsed once for every template that renders it.
+
+    Besides the columns of ``meeting_logs``, it has the command the line starts with (if it's
+    one of ``LOG_COMMANDS``), the line with its tag taken off, and the formatted timestamp.
+    Lines can also be indexed like the rows they come from, e.g. ``line["message"]``.
+    """
+
+    __slots__ = (
+        "command",
+        "datetime",
+        "line_num",
+        "meeting_id",
+        "message",
+        "sender",
+        "tag",
+        "text",
+        "time",
+        "timestamp",
+        "topic",
+    )
+
+    def __init__(self, meeting_id, timestamp, sender, message, tag, topic, line_num, prefix="^"):
+        self.meeting_id = meeting_id
+        self.timestamp = int(timestamp)
+        self.sender = sender
+        self.message = message
+        self.tag = tag
+        self.topic = topic
+        self.line_num = line_num
+        self.datetime, self.time = format_second(self.timestamp // 1000)
+        self.command = ""
+        if message.startswith("!"):
+            for command in LOG_COMMANDS:
+                if message.startswith(command, 1):
+                    self.command = command
+                    break
+        self.text = message.removeprefix(f"{prefix}{tag}").strip() if tag else message
+
+    @classmethod
+    def from_row(cls, row, prefix="^"):
+        if row is None:
+            return None
+        return cls(
+            row["meeting_id"],
+            row["timestamp"],
+            row["sender"],
+            row["message"],
+            row["tag"],
+            row["topic"],
+            row["line_num"],
+            prefix,
+        )
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"LogLine({self.meeting_id!r}, {self.timestamp}, {self.sender!r}, {self.message!r})"
@@ -0,0 +1,228 @@
+import contextvars
+import functools
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# The span the current task is in, so spans nest across awaits
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+@functools.lru_cache(maxsize=256)
+def query_name(query):
+    """A short name for a query, like ``SELECT meeting_logs``, to label its timings with"""
+    words = query.split()
+    if not words:
+        return ""
+    for i, word in enumerate(words[:-1]):
+        if word.upper() in ("FROM", "INTO", "UPDATE"):
+            return f"{words[0].upper()} {words[i + 1].strip('(,')}"
+    return words[0].upper()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, dict(key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down. Pass ``function`` to read it when the metrics are scraped"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def samples(self):
+        if self.function:
+            yield self.name, {}, self.function()
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            # one count per bucket, then +Inf, then the sum
+            counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-2] += 1
+        counts[-1] += value
+
+    def samples(self):
+        for key, counts in self.values.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, counts, strict=False):
+                yield f"{self.name}_bucket", {**labels, "le": bound}, count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, counts[-2]
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, counts[-2]
+
+
+class Span:
+    __slots__ = ("children", "duration", "labels", "name")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.duration = 0.0
+        self.children = []
+
+    def describe(self):
+        """One line with this span's time, and the time spent in each kind of child span"""
+        totals = {}
+        for child in self.children:
+            key = f"{child.name}{format_labels(child.labels)}"
+            count, duration = totals.get(key, (0, 0.0))
+            totals[key] = (count + 1, duration + child.duration)
+        children = ", ".join(
+            f"{key} {duration * 1000:.1f}ms" + (f" ({count}x)" if count > 1 else "")
+            for key, (count, duration) in totals.items()
+        )
+        line = f"{self.name}{format_labels(self.labels)} {self.duration * 1000:.1f}ms"
+        return f"{line}: {children}" if children else line
+
+
+class Metrics:
+    """The plugin's counters, gauges and latency histograms, rendered for Prometheus.
+
+    ``span`` times a block into a histogram. Spans nest, and when a top-level span takes longer
+    than ``slow_threshold`` seconds it is logged along with where its time went. A threshold of
+    0 turns that off.
+    """
+
+    def __init__(self, log, slow_threshold=0):
+        self.log = log
+        self.slow_threshold = slow_threshold
+        self.metrics = []
+
+        self.event_seconds = self.add(
+            Histogram("meetings_event_seconds", "Time spent handling a message event")
+        )
+        self.command_seconds = self.add(
+            Histogram("meetings_command_seconds", "Time spent running a command")
+        )
+        self.backend_seconds = self.add(
+            Histogram("meetings_backend_seconds", "Time spent in each phase of a backend")
+        )
+        self.query_seconds = self.add(
+            Histogram("meetings_db_query_seconds", "Time spent running a database query")
+        )
+        self.lines = self.add(Counter("meetings_lines_total", "Lines logged"))
+        self.tags = self.add(Counter("meetings_tags_total", "Tagged lines logged"))
+        self.sent = self.add(Counter("meetings_sent_total", "Events sent to rooms"))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+    @contextmanager
+    def span(self, histogram, **labels):
+        parent = current_span.get()
+        span = Span(histogram.name, labels)
+        token = current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - started
+            current_span.reset(token)
+            histogram.observe(span.duration, **labels)
+            if parent is not None:
+                parent.children.append(span)
+            elif self.slow_threshold and span.duration >= self.slow_threshold:
+                self.log.warning(f"Slow {span.describe()}")
+
+
+class TimedDatabase:
+    """Wraps a mautrix ``Database``, or a connection acquired from one, timing every query"""
+
+    def __init__(self, wrapped, metrics):
+        self.wrapped = wrapped
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self.wrapped.acquire() as conn:
+            yield TimedDatabase(conn, self.metrics)
+
+    def timed(self, query):
+        return self.metrics.span(self.metrics.query_seconds, query=query_name(query))
+
+    async def execute(self, query, *args, **kwargs):
+        with self.timed(query):
+            return await self.wrapped.execute(query, *args, **kwargs)
+
+    async def executemany(self, query, *args, **kwargs):
+        with self.timed(query):
+            return await self.wrapped.executemany(query, *args, **kwargs)
+
+    async def fetch(self, query, *args, **kwargs):
+        with self.timed(query):
+            return await self.wrapped.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        with self.timed(query):
+            return await self.wrapped.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        with self.timed(query):
+            return await self.wrapped.fetchval(query, *args, **kwargs)
@@ -0,0 +1,108 @@
+import contextvars
+import functools
+import importlib
+import importlib.util
+import time
+from contextlib import contextmanager
+
+from mautrix.util.async_db import UpgradeTable
+
+from .metrics import Gauge
+
+# Seconds taken to import each module loaded through import_timed, the first time it was loaded
+import_seconds = {}
+
+# Database upgrades run by the task that is starting the plugin, as (step, seconds). maubot
+# upgrades the database and then starts the plugin in the same task, so this is per instance
+upgrade_steps = contextvars.ContextVar("upgrade_steps", default=None)
+
+
+def import_timed(name, package=None):
+    started = time.perf_counter()
+    module = importlib.import_module(name, package)
+    import_seconds.setdefault(module.__name__, time.perf_counter() - started)
+    return module
+
+
+class LazyModule:
+    """A module that is only imported when one of its attributes is first used.
+
+    Meant for the heavy dependencies of a backend, so that loading the plugin doesn't pay for
+    them until they're needed. A missing dependency is still an error straight away.
+    """
+
+    def __init__(self, name):
+        if importlib.util.find_spec(name.partition(".")[0]) is None:
+            raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = import_timed(self._name)
+        return getattr(self._module, attr)
+
+
+class TimedUpgradeTable(UpgradeTable):
+    """An ``UpgradeTable`` that records how long each upgrade takes in ``upgrade_steps``"""
+
+    def register(self, _outer_fn=None, *, description="", **kwargs):
+        def timed_register(fn):
+            upgrade = super(TimedUpgradeTable, self).register(fn, description=description, **kwargs)
+            index = self.upgrades.index(upgrade)
+            step = f"db v{index + 1}: {description}"
+
+            @functools.wraps(upgrade)
+            async def timed(conn, scheme):
+                steps = upgrade_steps.get()
+                if steps is None:
+                    steps = []
+                    upgrade_steps.set(steps)
+                started = time.perf_counter()
+                try:
+                    return await upgrade(conn, scheme)
+                finally:
+                    steps.append((step, time.perf_counter() - started))
+
+            self.upgrades[index] = timed
+            return timed
+
+        return timed_register(_outer_fn) if _outer_fn else timed_register
+
+
+class ImportGauge(Gauge):
+    def samples(self):
+        for module, seconds in import_seconds.items():
+            yield self.name, {"module": module}, seconds
+
+
+class StartupReport:
+    """Times the steps of starting the plugin, then reports them in the logs and metrics"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started))
+
+    def finish(self, log, metrics):
+        total = time.perf_counter() - self.started
+        steps = [*(upgrade_steps.get() or []), *self.steps]
+        upgrade_steps.set(None)
+
+        startup = metrics.add(
+            Gauge("meetings_startup_seconds", "Time spent on each step of starting the plugin")
+        )
+        for name, seconds in steps:
+            startup.set(seconds, step=name)
+        startup.set(total, step="total")
+        metrics.add(ImportGauge("meetings_import_seconds", "Time spent importing each module"))
+
+        details = ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in steps)
+        log.info(f"Started in {total * 1000:.1f}ms: {details}")
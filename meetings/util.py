@@ -1,25 +1,104 @@
+import asyncio
+import time
+from collections import OrderedDict
 from datetime import datetime
 
 from mautrix.errors import MNotFound
 from mautrix.types import EventType
 
 
+class TTLCache:
+    """A small mapping whose entries expire ``ttl`` seconds after they were last set.
+
+    Once more than ``maxsize`` entries are stored, the least recently used ones are evicted.
+    """
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        try:
+            expires, _ = self._data[key]
+        except KeyError:
+            return False
+        if expires < time.monotonic():
+            del self._data[key]
+            return False
+        return True
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._data.move_to_end(key)
+        return self._data[key][1]
+
+    def __setitem__(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self._data.pop(key, None)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+
+# Room names and aliases, shared by every backend. Entries are updated from the room's state
+# events as they come in, the TTL only covers events the bot never got to see
+ROOM_METADATA_TTL = 60 * 60
+room_metadata = TTLCache(ROOM_METADATA_TTL, maxsize=4096)
+
+
+def update_room_metadata(room_id, event_type, value):
+    room_metadata[(room_id, event_type)] = value
+
+
 async def get_room_alias(client, room_id):
+    key = (room_id, EventType.ROOM_CANONICAL_ALIAS)
+    if key in room_metadata:
+        return room_metadata[key]
     try:
         existing_event = await client.get_state_event(room_id, EventType.ROOM_CANONICAL_ALIAS)
-        return existing_event.canonical_alias
+        alias = existing_event.canonical_alias
     except MNotFound:
         # typically if a room is a direct message, it wont have a canonical alias
-        return None
+        alias = None
+    room_metadata[key] = alias
+    return alias
 
 
 async def get_room_name(client, room_id):
+    key = (room_id, EventType.ROOM_NAME)
+    if key in room_metadata:
+        return room_metadata[key]
     try:
         existing_event = await client.get_state_event(room_id, EventType.ROOM_NAME)
-        return existing_event.name
+        name = existing_event.name
     except MNotFound:
         # typically if a room is a direct message, it wont have a canonical alias
-        return None
+        name = None
+    room_metadata[key] = name
+    return name
+
+
+async def get_room_info(client, room_id):
+    """Look up the name and canonical alias of a room at the same time"""
+    return await asyncio.gather(get_room_name(client, room_id), get_room_alias(client, room_id))
 
 
 def time_from_timestamp(timestamp, format="%Y-%m-%d %H:%M:%S"):
@@ -0,0 +1,43 @@
+import asyncio
+import contextlib
+
+
+class Worker:
+    """A background task that calls ``run_once`` over and over.
+
+    ``run_once`` returns how many seconds to wait before it runs again, or None to wait until
+    ``wakeup`` is set, which also cuts any wait short. If it raises, the error is logged and it
+    runs again after ``error_delay`` seconds, with ``doing`` describing the work in the message.
+    """
+
+    doing = "running in the background"
+    error_delay = 60
+
+    def __init__(self, log):
+        self.log = log
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                delay = await self.run_once()
+            except Exception as e:
+                self.log.exception(f"Error {self.doing}: {e}")
+                delay = self.error_delay
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+
+    async def run_once(self):
+        raise NotImplementedError
@@ -0,0 +1,85 @@
+import json
+import platform
+import time
+from collections import Counter
+
+import httpx
+import pytest
+import pytest_asyncio
+from mautrix.util.async_db.connection import LoggingConnection
+
+BACKENDS = ["none", "ansible", "fedora"]
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(pytestconfig):
+    results = {}
+    yield results
+    path = pytestconfig.getoption("--benchmarks")
+    if path and results:
+        report = {
+            "python": platform.python_version(),
+            "time": int(time.time()),
+            "rooms": pytestconfig.getoption("--benchmark-rooms"),
+            "messages": pytestconfig.getoption("--benchmark-messages"),
+            "results": results,
+        }
+        with open(path, "w") as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+
+
+@pytest.fixture
+def query_counter(monkeypatch):
+    # Every query goes through a LoggingConnection, whether it's run on the database or on a
+    # connection acquired for a transaction
+    counts = Counter()
+    for name in ["execute", "executemany", "fetch", "fetchrow", "fetchval"]:
+        original = getattr(LoggingConnection, name)
+
+        def counted(self, *args, _original=original, _name=name, **kwargs):
+            counts[_name] += 1
+            return _original(self, *args, **kwargs)
+
+        monkeypatch.setattr(LoggingConnection, name, counted)
+    return counts
+
+
+@pytest.fixture
+def fedora_stand_ins(respx_mock, monkeypatch):
+    # FASJSON knows everyone, and the broker accepts every message
+    pytest.importorskip("httpx_gssapi")
+    from meetings.backends.fedora import publisher
+
+    respx_mock.get("https://fasjson.example.com/v1/search/users/").mock(
+        return_value=httpx.Response(200, json={"result": [{"username": "someone"}]})
+    )
+    published = []
+    monkeypatch.setattr(publisher.fm_api, "publish", published.append)
+    return published
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+
+@pytest_asyncio.fixture
+async def plugin_config_overrides(request, backend, discourse, tmp_path):
+    if backend == "ansible":
+        backend_data = {
+            "discourse_user": "meetbot",
+            "discourse_key": "key",
+            "discourse_url": discourse["url"],
+            "category_id": 1,
+        }
+    elif backend == "fedora":
+        request.getfixturevalue("fedora_stand_ins")
+        backend_data = {
+            "fasjson_url": "https://fasjson.example.com",
+            "logs_baseurl": "https://meetbot.example.com/",
+            "logs_directory": str(tmp_path),
+            "send_fedoramessages": True,
+        }
+    else:
+        return {"backend": ""}
+    return {"backend": backend, "backend_data": {backend: backend_data}}
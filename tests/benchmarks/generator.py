@@ -0,0 +1,38 @@
+import random
+
+from ..bot import SENDER
+
+TAGS = ["action", "info", "agreed", "rejected", "idea", "halp", "link"]
+WORDS = (
+    "the release is blocked on a review of the packaging changes so we should ask someone "
+    "from infra to look at the builders before friday and update the docs and the wiki"
+).split()
+
+
+def sentence(rng, words=(4, 20)):
+    return " ".join(rng.choices(WORDS, k=rng.randint(*words)))
+
+
+def meeting(rng, messages, attendees=8):
+    """A meeting's worth of (sender, body) messages: !startmeeting, then mostly chatter with
+    some multi-line pastes, tags and topic changes, then !endmeeting"""
+    senders = [SENDER] + [f"@attendee{i}:example.com" for i in range(1, attendees)]
+    yield SENDER, "!startmeeting"
+    for _ in range(messages):
+        kind = rng.random()
+        if kind < 0.03:
+            yield SENDER, f"!topic {sentence(rng, (2, 5))}"
+        elif kind < 0.15:
+            yield rng.choice(senders), f"^{rng.choice(TAGS)} {sentence(rng)}"
+        elif kind < 0.22:
+            lines = [sentence(rng, (2, 12)) for _ in range(rng.randint(3, 30))]
+            yield rng.choice(senders), "\n".join(lines)
+        else:
+            yield rng.choice(senders), sentence(rng)
+    yield SENDER, "!endmeeting"
+
+
+def rooms(count, messages, seed=0):
+    """Messages for ``count`` rooms, the same ones every time for the same seed"""
+    rng = random.Random(seed)  # noqa: S311
+    return {f"!room{i}:example.com": list(meeting(rng, messages)) for i in range(count)}
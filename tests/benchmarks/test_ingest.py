@@ -0,0 +1,78 @@
+import asyncio
+import statistics
+import time
+
+import pytest
+
+from . import generator
+
+pytestmark = pytest.mark.benchmark
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50": cuts[49] * 1000,
+        "p90": cuts[89] * 1000,
+        "p99": cuts[98] * 1000,
+        "max": max(samples) * 1000,
+    }
+
+
+async def test_ingest(backend, bot, plugin, query_counter, benchmark_results, pytestconfig):
+    rooms = generator.rooms(
+        pytestconfig.getoption("--benchmark-rooms"), pytestconfig.getoption("--benchmark-messages")
+    )
+    # Jobs are run by hand below, so they are timed and not left running in the background
+    await plugin.jobs.stop()
+
+    latencies = []
+
+    async def run_meeting(room_id, messages):
+        for sender, body in messages:
+            started = time.perf_counter()
+            await bot.send(body, room_id=room_id, sender=sender)
+            latencies.append(time.perf_counter() - started)
+
+    # Every room's meeting runs at once, up to the point it ends
+    queries = sum(query_counter.values())
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(run_meeting(room_id, messages[:-1]) for room_id, messages in rooms.items())
+    )
+    ingest_seconds = time.perf_counter() - started
+    ingest_queries = sum(query_counter.values()) - queries
+
+    # Then each one ends, and the backend processes it
+    endmeeting_seconds = []
+    queries = sum(query_counter.values())
+    for room_id in rooms:
+        started = time.perf_counter()
+        await bot.send("!endmeeting", room_id=room_id)
+        await plugin.jobs.run_due()
+        endmeeting_seconds.append(time.perf_counter() - started)
+    endmeeting_queries = sum(query_counter.values()) - queries
+
+    assert await plugin.database.fetchval("SELECT COUNT(*) FROM meeting_jobs") == 0
+    assert await plugin.database.fetchval("SELECT COUNT(*) FROM meeting_archive") == len(rooms)
+
+    events = len(latencies)
+    lines = sum(len(body.splitlines()) for messages in rooms.values() for _, body in messages[:-1])
+    benchmark_results[backend] = {
+        "events": events,
+        "lines": lines,
+        "ingest_seconds": ingest_seconds,
+        "events_per_second": events / ingest_seconds,
+        "lines_per_second": lines / ingest_seconds,
+        "event_latency_ms": percentiles(latencies),
+        "queries": {
+            "ingest": ingest_queries,
+            "per_event": ingest_queries / events,
+            "endmeeting": endmeeting_queries,
+            "endmeeting_per_meeting": endmeeting_queries / len(rooms),
+        },
+        "endmeeting_seconds": {
+            "mean": statistics.mean(endmeeting_seconds),
+            "max": max(endmeeting_seconds),
+        },
+    }
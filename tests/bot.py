@@ -13,6 +13,7 @@ from mautrix.types import (
     RoomAlias,
     RoomID,
     RoomNameStateEventContent,
+    StateEvent,
     TextMessageEventContent,
 )
 
@@ -35,6 +36,7 @@ class TestBot(MaubotMatrixClient):
         self.client.send_message_event = self._mock_send_message_event
         self.client.get_state_event = self._mock_get_state_event
         self.timestamp = 0
+        self.state_requests = []
 
     async def _mock_send_message_event(self, room_id, event_type, content, txn_id=None, **kwargs):
         self.sent.append(
@@ -42,6 +44,7 @@ class TestBot(MaubotMatrixClient):
         )
 
     async def _mock_get_state_event(self, room_id, event_type, **kwargs):
+        self.state_requests.append((room_id, event_type))
         if event_type == EventType.ROOM_POWER_LEVELS:
             return PowerLevelStateEventContent(users={SENDER: 50})
         if event_type == EventType.ROOM_NAME:
@@ -51,13 +54,13 @@ class TestBot(MaubotMatrixClient):
                 canonical_alias=RoomAlias("@testroom:example.com")
             )
 
-    async def send(self, content, room_id="testroom"):
+    async def send(self, content, room_id="testroom", sender=SENDER):
         self.timestamp = self.timestamp + 10000
         event = MessageEvent(
             type=EventType.ROOM_MESSAGE,
             room_id=room_id,
             event_id="test",
-            sender=SENDER,
+            sender=sender,
             timestamp=self.timestamp,
             content=TextMessageEventContent(msgtype=MessageType.TEXT, body=content),
         )
@@ -65,3 +68,17 @@ class TestBot(MaubotMatrixClient):
             EventType.ROOM_MESSAGE, MaubotMessageEvent(event, self.client), force_synchronous=True
         )
         return await asyncio.gather(*tasks)
+
+    async def send_state(self, event_type, content, room_id="testroom"):
+        self.timestamp = self.timestamp + 10000
+        event = StateEvent(
+            type=event_type,
+            room_id=room_id,
+            event_id="test",
+            sender=SENDER,
+            timestamp=self.timestamp,
+            state_key="",
+            content=content,
+        )
+        tasks = self.client.dispatch_manual_event(event_type, event, force_synchronous=True)
+        return await asyncio.gather(*tasks)
@@ -3,7 +3,10 @@ import logging
 from pathlib import Path
 
 import aiohttp
+import pytest
 import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from maubot.loader import PluginMeta
 from maubot.standalone.loader import FileSystemLoader
 from mautrix.util.async_db import Database
@@ -12,10 +15,37 @@ from mautrix.util.logging import TraceLogger
 from ruamel.yaml import YAML
 
 from meetings import Config, Meetings
+from meetings.util import room_metadata
 
 from .bot import TestBot
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--benchmarks",
+        metavar="PATH",
+        help="run the benchmarks in tests/benchmarks, writing the results to PATH as JSON",
+    )
+    group.addoption("--benchmark-rooms", type=int, default=4, help="rooms to run meetings in")
+    group.addoption("--benchmark-messages", type=int, default=200, help="messages per meeting")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks only run with --benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clear_room_metadata():
+    # The room metadata cache is shared at module level, so don't let it leak between tests
+    room_metadata.clear()
+
+
 @pytest_asyncio.fixture
 async def bot():
     return TestBot()
@@ -34,6 +64,34 @@ async def db(tmp_path):
     await db.stop()
 
 
+@pytest_asyncio.fixture
+async def discourse():
+    # A stand-in for Discourse. It answers the first ``failures`` attempts at posting with
+    # ``status``, and accepts everything else
+    server_state = {"uploads": [], "posts": [], "attempts": 0, "status": 429, "failures": 0}
+
+    async def uploads(request):
+        form = await request.post()
+        server_state["uploads"].append(form["files[]"].file.read().decode())
+        return web.json_response({"short_url": "upload://full_log.txt"})
+
+    async def posts(request):
+        server_state["attempts"] += 1
+        if server_state["attempts"] <= server_state["failures"]:
+            return web.Response(status=server_state["status"])
+        server_state["posts"].append(dict(await request.post()))
+        return web.json_response({"topic_id": len(server_state["posts"])})
+
+    app = web.Application()
+    app.router.add_post("/uploads.json", uploads)
+    app.router.add_post("/posts", posts)
+    server = TestServer(app)
+    await server.start_server()
+    server_state["url"] = str(server.make_url("")).rstrip("/")
+    yield server_state
+    await server.close()
+
+
 @pytest_asyncio.fixture
 async def plugin_config_overrides():
     return {}
@@ -81,3 +139,4 @@ async def plugin(bot, db, plugin_config_overrides):
         )
         await instance.internal_start()
         yield instance
+        await instance.internal_stop()
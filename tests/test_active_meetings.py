@@ -0,0 +1,40 @@
+import pytest
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_registry_tracks_meeting(bot, plugin, db):
+    # The in-memory registry follows the meetings table through a meeting's life
+    await bot.send("!startmeeting")
+    meeting = plugin.meeting_in_progress("testroom")
+    assert meeting["meeting_name"] == "Test Room"
+    assert meeting["topic"] == ""
+
+    await bot.send("!topic pants")
+    await bot.send("!meetingname trousers")
+    meeting = plugin.meeting_in_progress("testroom")
+    assert meeting["topic"] == "pants"
+    assert meeting["meeting_name"] == "trousers"
+
+    row = await db.fetchrow("SELECT * FROM meetings WHERE room_id = $1", "testroom")
+    assert dict(row) == meeting
+
+    await bot.send("!endmeeting")
+    assert plugin.meeting_in_progress("testroom") is None
+    assert await db.fetchrow("SELECT * FROM meetings") is None
+
+
+async def test_registry_loaded_on_start(bot, plugin, db):
+    # Meetings already in the database are picked up again when the plugin (re)starts
+    await bot.send("!startmeeting")
+    await bot.send("!topic pants")
+    await plugin.stop()
+    plugin.active_meetings.clear()
+
+    await plugin.start()
+    assert plugin.meeting_in_progress("testroom")["topic"] == "pants"
+    assert plugin.database.wrapped is db
+
+    await bot.send("foo")
+    meeting_logs = await db.fetch("SELECT * FROM meeting_logs ORDER BY timestamp")
+    assert meeting_logs[-1]["message"] == "foo"
+    assert meeting_logs[-1]["topic"] == "pants"
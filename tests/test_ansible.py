@@ -0,0 +1,118 @@
+import pytest_asyncio
+
+from meetings.backends import ansible
+from meetings.logline import LogLine
+
+
+@pytest_asyncio.fixture
+async def plugin_config_overrides(discourse):
+    return {
+        "backend": "ansible",
+        "backend_data": {
+            "ansible": {
+                "discourse_user": "meetbot",
+                "discourse_key": "key",
+                "discourse_url": discourse["url"],
+                "category_id": 1,
+            }
+        },
+    }
+
+
+async def test_templates_compiled_at_start(plugin):
+    # The ansible templates are loaded once when the plugin starts
+    assert len(plugin.j2envs["ansible"].cache) == len(ansible.TEMPLATES)
+
+
+async def test_render(plugin):
+    items = [
+        LogLine("m", 0, "@a:example.com", "<b>", None, "", 0),
+        LogLine("m", 60000, "@a:example.com", "^info <b>", "info", "", 1),
+    ]
+    people_present = [{"sender": "@a:example.com", "count": 2}]
+
+    # Only the HTML templates are escaped
+    text_log = await ansible.render(plugin, "text_log.j2", items=items)
+    assert "<@a:example.com> <b>" in text_log
+
+    minutes = await ansible.render(
+        plugin,
+        "html_minutes.j2",
+        items=items[1:],
+        actions=[],
+        first=items[0],
+        last=items[-1],
+        name="Meeting",
+        room="Room",
+        alias="#room:example.com",
+        people_present=people_present,
+        logs="",
+    )
+    assert "<li>INFO: &lt;b&gt; (@a:example.com, " in minutes
+
+
+async def test_endmeeting_posts_to_discourse(bot, plugin, db, discourse, monkeypatch):
+    monkeypatch.setattr(ansible, "DISCOURSE_BACKOFF", 0)
+    discourse["failures"] = 1
+    await bot.send("!startmeeting")
+    await bot.send("^info pants")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+
+    assert len(discourse["uploads"]) == 1
+    assert "<@dummy:example.com> ^info pants" in discourse["uploads"][0]
+
+    # the first attempt was rate limited and was retried
+    assert discourse["attempts"] == 2
+    post = discourse["posts"][0]
+    assert post["category"] == "1"
+    assert "[full_log.txt|attachment](upload://full_log.txt)" in post["raw"]
+    assert "<li>INFO: pants (@dummy:example.com, " in post["raw"]
+    assert f"{discourse['url']}/t/1" in bot.sent[-1].content.formatted_body
+
+
+async def test_failed_post_is_not_repeated(bot, plugin, db, discourse, monkeypatch):
+    # Discourse may have created the topic before failing, so the post isn't sent again, by
+    # the backend or the job queue
+    monkeypatch.setattr(ansible, "DISCOURSE_BACKOFF", 0)
+    discourse["status"], discourse["failures"] = 503, 1
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+
+    assert discourse["attempts"] == 1
+    assert discourse["posts"] == []
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_jobs") == 0
+    assert "may not have been posted" in bot.sent[-1].content.body
+    assert f"!rerender {plugin.meeting_id('testroom')}" in bot.sent[-1].content.body
+
+
+async def test_rejected_post_is_not_retried(bot, plugin, db, discourse, monkeypatch):
+    # Posting with a bad key or to a missing category fails the same way every time
+    monkeypatch.setattr(ansible, "DISCOURSE_BACKOFF", 0)
+    discourse["status"], discourse["failures"] = 403, 1
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+
+    assert discourse["attempts"] == 1
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_jobs") == 0
+    assert "Discourse rejected the minutes" in bot.sent[-1].content.body
+
+
+async def test_rate_limited_post_is_retried_later(bot, plugin, db, discourse, monkeypatch):
+    # Nothing was posted, so the job queue can safely try again
+    monkeypatch.setattr(ansible, "DISCOURSE_BACKOFF", 0)
+    discourse["failures"] = ansible.DISCOURSE_RETRIES
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+
+    assert discourse["attempts"] == ansible.DISCOURSE_RETRIES
+    job = await db.fetchrow("SELECT * FROM meeting_jobs")
+    assert (job["attempts"], job["backends_done"]) == (1, "[]")
+
+    await db.execute("UPDATE meeting_jobs SET next_attempt = 0")
+    await plugin.jobs.run_due()
+    assert len(discourse["posts"]) == 1
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_jobs") == 0
@@ -0,0 +1,148 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+from meetings.backends import Backend
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_endmeeting_archives_logs(bot, plugin, db):
+    await bot.send("!startmeeting")
+    await bot.send("^info foo\nbar")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+
+    meeting_id = plugin.meeting_id("testroom")
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_logs") == 0
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_attendance") == 0
+
+    meeting, items = await plugin.archive.get(meeting_id)
+    assert meeting["room_id"] == "testroom"
+    assert meeting["lines"] == 4
+    assert meeting["started"] == items[0]["timestamp"]
+    assert [(item["message"], item["tag"]) for item in items] == [
+        ("!startmeeting", None),
+        ("^info foo", "info"),
+        ("bar", None),
+        ("!endmeeting", None),
+    ]
+
+    await bot.send("!archived")
+    assert meeting_id in bot.sent[-1].content.body
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_second_meeting_same_day(bot, plugin, db):
+    # The first meeting of the day already owns the usual meeting_id in the archive
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_jobs") == 0
+    meeting_ids = await db.fetch("SELECT meeting_id FROM meeting_archive ORDER BY started")
+    first, second = (row["meeting_id"] for row in meeting_ids)
+    assert first == plugin.meeting_id("testroom")
+    assert second.startswith(f"{first}-")
+
+    # Archiving a meeting again doesn't fail, whether or not its logs are gone
+    meeting = {"meeting_id": first, "room_id": "testroom", "meeting_name": "", "topic": ""}
+    async with db.acquire() as conn, conn.transaction():
+        await plugin.archive.add(conn, meeting)
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_archive") == 2
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": "", "archive_retention_days": 30}])
+async def test_prune(bot, plugin, db):
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+    assert await plugin.archive.prune() == 0
+
+    await db.execute("UPDATE meeting_archive SET archived_at = archived_at - 31 * 24 * 60 * 60")
+    assert await plugin.archive.prune() == 1
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_archive") == 0
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_rerender(bot, plugin, db):
+    rendered = []
+
+    async def endmeeting(meetbot, event, meeting):
+        items = await meetbot.get_items(meeting["meeting_id"])
+        people_present = await meetbot.get_people_present(meeting["meeting_id"])
+        rendered.append(([row["message"] for row in items], [tuple(p) for p in people_present]))
+
+    plugin.backends = [Backend("test", SimpleNamespace(endmeeting=endmeeting))]
+    await bot.send("!startmeeting")
+    await bot.send("foo")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+
+    meeting_id = plugin.meeting_id("testroom")
+    await bot.send(f"!rerender {meeting_id}", room_id="otherroom")
+    assert bot.sent[-1].content.body == f"No archived meeting {meeting_id} in this room"
+
+    await bot.send(f"!rerender {meeting_id}")
+    await plugin.jobs.run_due()
+    assert len(rendered) == 2
+    assert rendered[0] == rendered[1]
+    assert await plugin.archive.get_metadata(meeting_id) is not None
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_logs") == 0
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": "", "web_token": "sekrit"}])
+async def test_search(bot, plugin, db):
+    await bot.send("!startmeeting")
+    await bot.send("!topic releases")
+    await bot.send("^agreed we ship the release on friday")
+    await bot.send("something else entirely")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+    meeting_id = plugin.meeting_id("testroom")
+
+    hits = await plugin.archive.search("testroom", "friday release")
+    assert [(hit["message"], hit["topic"]) for hit in hits] == [
+        ("^agreed we ship the release on friday", "releases")
+    ]
+    assert hits[0]["meeting_name"] == "Test Room"
+
+    # query syntax is searched for like any other words, and other rooms are not searched
+    assert await plugin.archive.search("testroom", 'friday" OR (') == []
+    assert await plugin.archive.search("otherroom", "friday") == []
+
+    await bot.send("!search friday")
+    assert "we ship the release on friday" in bot.sent[-1].content.body
+
+    request = make_mocked_request(
+        "GET",
+        "/search/testroom?q=friday",
+        headers={"Authorization": "Bearer sekrit"},
+        match_info={"room_id": "testroom"},
+    )
+    response = await plugin.search_page(request)
+    assert [hit["meeting_id"] for hit in json.loads(response.text)] == [meeting_id]
+
+    request = make_mocked_request(
+        "GET", "/search/testroom?q=friday&token=sekrit", match_info={"room_id": "testroom"}
+    )
+    assert (await plugin.search_page(request)).status == 200
+    for path in ("/search/testroom?q=friday", "/search/testroom?q=friday&token=wrong"):
+        request = make_mocked_request("GET", path, match_info={"room_id": "testroom"})
+        assert (await plugin.search_page(request)).status == 401
+
+    # Without a token to protect them, search results aren't served at all
+    plugin.config["web_token"] = ""
+    request = make_mocked_request(
+        "GET", "/search/testroom?q=friday&token=", match_info={"room_id": "testroom"}
+    )
+    assert (await plugin.search_page(request)).status == 404
+
+    # Restoring a meeting takes it out of the index until it's archived again
+    async with db.acquire() as conn, conn.transaction():
+        await plugin.archive.restore(conn, meeting_id)
+    assert await plugin.archive.search("testroom", "friday") == []
@@ -0,0 +1,27 @@
+import pytest
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_people_present(bot, plugin, db):
+    # Line counts are kept as lines are logged, and match counting the log itself
+    await bot.send("!startmeeting")
+    await bot.send("foo\nbar\nbaz", sender="@other:example.com")
+    await bot.send("qux")
+
+    meeting_id = plugin.meeting_id("testroom")
+    people_present = await plugin.get_people_present(meeting_id)
+    assert [(p["sender"], p["count"]) for p in people_present] == [
+        ("@dummy:example.com", 2),
+        ("@other:example.com", 3),
+    ]
+
+    counted = await db.fetch(
+        "SELECT sender, COUNT(*) AS count FROM meeting_logs WHERE meeting_id = $1 "
+        "GROUP BY sender ORDER BY count",
+        meeting_id,
+    )
+    assert [tuple(p) for p in people_present] == [tuple(c) for c in counted]
+
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_attendance") == 0
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from meetings.backends import BACKEND_TIMEOUT, Backend, configured_backends
+
+
+def test_configured_backends():
+    [backend] = configured_backends({"backend": "ansible"})
+    assert (backend.name, backend.timeout) == ("ansible", BACKEND_TIMEOUT)
+
+    backends = configured_backends(
+        {"backend": ["ansible"], "backend_data": {"ansible": {"timeout_seconds": 5}}}
+    )
+    assert [(backend.name, backend.timeout) for backend in backends] == [("ansible", 5)]
+    assert configured_backends({"backend": ""}) == []
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_failing_backend_is_retried_alone(bot, plugin, db):
+    ended = []
+    broken = [True]
+
+    async def endmeeting(meetbot, event, meeting):
+        ended.append("good")
+
+    async def broken_endmeeting(meetbot, event, meeting):
+        if broken[0]:
+            raise RuntimeError("backend is broken")
+        ended.append("broken")
+
+    await plugin.jobs.stop()
+    plugin.backends = [
+        Backend("good", SimpleNamespace(endmeeting=endmeeting)),
+        Backend("broken", SimpleNamespace(endmeeting=broken_endmeeting)),
+    ]
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+    assert ended == ["good"]
+    job = await db.fetchrow("SELECT * FROM meeting_jobs")
+    assert (job["attempts"], job["backends_done"]) == (1, '["good"]')
+
+    broken[0] = False
+    await db.execute("UPDATE meeting_jobs SET next_attempt = 0")
+    await plugin.jobs.run_due()
+    assert ended == ["good", "broken"]
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_jobs") == 0
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_archive") == 1
+    plugin.backends = []
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_slow_backend_times_out(bot, plugin, db):
+    started = []
+
+    async def startmeeting(meetbot, event, meeting):
+        started.append("fast")
+
+    async def slow_startmeeting(meetbot, event, meeting):
+        await asyncio.sleep(60)
+
+    plugin.backends = [
+        Backend("slow", SimpleNamespace(startmeeting=slow_startmeeting), timeout=0.01),
+        Backend("fast", SimpleNamespace(startmeeting=startmeeting)),
+    ]
+    await bot.send("!startmeeting")
+    await plugin.dispatcher.drain()
+    assert started == ["fast"]
+    assert bot.sent[0].content.body.startswith("Meeting started at")
+    assert plugin.meeting_in_progress("testroom")
+    plugin.backends = []
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_startmeeting_backends_run_in_background(bot, plugin, db):
+    # Logging carries on while the backends handle the meeting starting
+    release = asyncio.Event()
+    started = []
+
+    async def startmeeting(meetbot, event, meeting):
+        await release.wait()
+        started.append(meeting["meeting_id"])
+
+    plugin.backends = [Backend("slow", SimpleNamespace(startmeeting=startmeeting))]
+    await bot.send("!startmeeting")
+    await bot.send("foo")
+    assert started == []
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_logs") == 2
+
+    release.set()
+    await plugin.dispatcher.drain()
+    assert started == [plugin.meeting_id("testroom")]
+    plugin.backends = []
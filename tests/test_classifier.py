@@ -0,0 +1,63 @@
+import re
+
+import pytest
+
+from meetings.classifier import LineClassifier
+
+TAGS = ["action", "info", "agreed", "idea"]
+COMMANDS = ["topic", "meetingname", "startmeeting", "endmeeting"]
+
+LINES = [
+    "",
+    "!",
+    "! startmeeting",
+    "!startmeeting",
+    "!sm  A meeting name  ",
+    "!em",
+    "!t\tnew topic",
+    "!unknown thing",
+    "^info",
+    "^info something",
+    "^info\tsomething",
+    "^infos something",
+    "^nope something",
+    "some ^action in the middle",
+    "a^b^agreed at the end ",
+    "^idea first, then ^info last",
+    "^idea then ^info, not a tag",
+    "^" * 50,
+]
+
+
+@pytest.mark.parametrize("at_start", [True, False])
+@pytest.mark.parametrize("line", LINES)
+def test_matches_regexes(line, at_start):
+    # The classifier agrees with the regexes it replaced
+    command_re = re.compile(r"^!(\S+)(?:\s+|$)(.*)")
+    start = "(^)" if at_start else "(^.*)"
+    tags_re = re.compile(f"{start}\\^({'|'.join(TAGS)})($| .*)")
+    aliases = {"t": "topic", "mn": "meetingname", "sm": "startmeeting", "em": "endmeeting"}
+
+    command, argument = None, ""
+    match = command_re.search(line)
+    if match:
+        command, argument = match.groups()
+        command = aliases.get(command, command)
+        if command not in COMMANDS:
+            command, argument = None, ""
+    tag, tag_text = None, ""
+    tagsmatch = re.findall(tags_re, line)
+    if tagsmatch:
+        _, tag, tag_text = tagsmatch[0]
+
+    classify = LineClassifier(TAGS, at_start=at_start, commands=COMMANDS)
+    classified = classify(line)
+    assert (classified.command, classified.tag, classified.tag_text) == (command, tag, tag_text)
+    if command:
+        assert classified.argument == argument
+
+
+def test_custom_prefix():
+    classify = LineClassifier(TAGS, prefix="#!", at_start=False)
+    assert classify("look #!info here")[2:] == ("info", " here")
+    assert classify("look ^info #!inform").tag is None
@@ -0,0 +1,56 @@
+import logging
+
+from mautrix.util.async_db import Database, UpgradeTable
+
+from meetings.db import upgrade_table
+
+
+async def test_timestamps_are_integers(bot, plugin, db):
+    # Timestamps are stored as numbers so they sort and compare numerically
+    await bot.send("!startmeeting")
+    await bot.send("foo")
+
+    meeting_logs = await db.fetch("SELECT * FROM meeting_logs ORDER BY timestamp, line_num")
+    assert [row["timestamp"] for row in meeting_logs] == [10000, 20000]
+
+
+async def test_meeting_logs_indexes(db):
+    indexes = await db.fetch(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'meeting_logs'"
+    )
+    assert {row["name"] for row in indexes} == {
+        "meeting_logs_meeting_idx",
+        "meeting_logs_tagged_idx",
+    }
+
+
+async def test_upgrade_v6_converts_timestamps(tmp_path):
+    # Databases created before v6 have text timestamps which need to survive the conversion
+    db_path = tmp_path.joinpath("upgrade.db").as_posix()
+    old_upgrade_table = UpgradeTable()
+    old_upgrade_table.upgrades = upgrade_table.upgrades[:5]
+    db = Database.create(
+        f"sqlite:///{db_path}", upgrade_table=old_upgrade_table, log=logging.getLogger("db")
+    )
+    await db.start()
+    await db.executemany(
+        "INSERT INTO meeting_logs (meeting_id, timestamp, sender, message, tag, topic, line_num) "
+        "VALUES ($1, $2, $3, $4, $5, $6, $7)",
+        [
+            ("meeting", "100000", "@a:example.com", "later", None, "", 0),
+            ("meeting", "99999", "@a:example.com", "earlier", "info", "pants", 1),
+        ],
+    )
+    await db.stop()
+
+    db = Database.create(
+        f"sqlite:///{db_path}", upgrade_table=upgrade_table, log=logging.getLogger("db")
+    )
+    await db.start()
+    meeting_logs = await db.fetch("SELECT * FROM meeting_logs ORDER BY timestamp")
+    await db.stop()
+
+    assert [tuple(row) for row in meeting_logs] == [
+        ("meeting", 99999, "@a:example.com", "earlier", "info", "pants", 1, 2),
+        ("meeting", 100000, "@a:example.com", "later", None, "", 0, 1),
+    ]
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from mautrix.errors import MatrixUnknownRequestError, MLimitExceeded
+from mautrix.types import EventType, MessageType
+
+from meetings import dispatcher
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_tags_coalesced(bot, plugin):
+    await bot.send("!startmeeting")
+    await plugin.dispatcher.drain()
+    sent = len(bot.sent)
+
+    await bot.send("^info one\n^action two\n^info three\n!topic four")
+    await plugin.dispatcher.drain()
+
+    messages = [s.content for s in bot.sent[sent:] if s.event_type == EventType.ROOM_MESSAGE]
+    reactions = [s.content for s in bot.sent[sent:] if s.event_type == EventType.REACTION]
+    assert [(m.msgtype, m.body) for m in messages] == [
+        (
+            MessageType.EMOTE,
+            "✏️INFO: one\n🚩ACTION: two\n✏️INFO: three\nThe Meeting Topic is now four",
+        )
+    ]
+    assert sorted(r.relates_to.key for r in reactions) == sorted(["✏️", "🚩"])
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_ingest_does_not_wait(bot, plugin, db):
+    await bot.send("!startmeeting")
+    await plugin.dispatcher.drain()
+
+    # The homeserver is stuck, but the lines are logged anyway
+    unblock = asyncio.Event()
+    send_message_event = bot.client.send_message_event
+
+    async def stuck(*args, **kwargs):
+        await unblock.wait()
+        return await send_message_event(*args, **kwargs)
+
+    bot.client.send_message_event = stuck
+    await asyncio.wait_for(bot.send("^info one"), timeout=1)
+    await asyncio.wait_for(bot.send("^info two"), timeout=1)
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_logs WHERE tag = 'info'") == 2
+
+    unblock.set()
+    await plugin.dispatcher.drain()
+    echoes = [s.content.body for s in bot.sent if s.event_type == EventType.ROOM_MESSAGE]
+    assert echoes[-2:] == ["✏️INFO: one", "✏️INFO: two"]
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_rate_limited_sends_retried(bot, plugin, monkeypatch):
+    monkeypatch.setattr(dispatcher, "DISPATCH_BACKOFF", 0)
+    send_message_event = bot.client.send_message_event
+    failures = [
+        MLimitExceeded(429, "Too many requests"),
+        MatrixUnknownRequestError(429, '{"retry_after_ms": 1}', "M_LIMIT_EXCEEDED"),
+    ]
+
+    async def limited(*args, **kwargs):
+        if failures:
+            raise failures.pop(0)
+        return await send_message_event(*args, **kwargs)
+
+    bot.client.send_message_event = limited
+    await bot.send("!startmeeting")
+    await plugin.dispatcher.drain()
+    assert bot.sent[0].content.body.startswith("Meeting started at")
+
+
+def test_retry_after():
+    assert dispatcher.retry_after(MLimitExceeded(429, ""), 2) == dispatcher.DISPATCH_BACKOFF * 4
+    error = MatrixUnknownRequestError(429, '{"retry_after_ms": 1500}', "M_LIMIT_EXCEEDED")
+    assert dispatcher.retry_after(error, 0) == 1.5
+    assert dispatcher.retry_after(MatrixUnknownRequestError(500, "", "M_UNKNOWN"), 0) is None
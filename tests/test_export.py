@@ -0,0 +1,81 @@
+import pytest
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_export(bot, plugin, db):
+    await bot.send("!startmeeting")
+    await bot.send("foo\n^action ask around", sender="@other:example.com")
+    await bot.send("!topic pants\n^info bar\nbaz")
+    await bot.send("^action buy pants", sender="@other:example.com")
+
+    meeting_id = plugin.meeting_id("testroom")
+    export = await plugin.export(meeting_id)
+
+    assert export.first["message"] == "!startmeeting"
+    assert export.last["message"] == "^action buy pants"
+    assert export.chair == "@dummy:example.com"
+    assert [line.text for line in export.items] == [
+        "ask around",
+        "!topic pants",
+        "bar",
+        "buy pants",
+    ]
+    assert [line.text for line in export.actions] == ["ask around", "buy pants"]
+
+    # The line counts match the ones kept while the meeting went on
+    people_present = await plugin.get_people_present(meeting_id)
+    assert export.people_present == [dict(p) for p in people_present]
+
+    assert [(t.topic, t.line and t.line.message, t.lines) for t in export.topics] == [
+        ("", None, 3),
+        ("pants", "!topic pants", 4),
+    ]
+    assert [[line.text for line in t.items] for t in export.topics] == [
+        ["ask around"],
+        ["bar", "buy pants"],
+    ]
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_export_empty(plugin):
+    export = await plugin.export("missing")
+    assert export.first is None
+    assert export.items == []
+    assert export.people_present == []
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_live_export(bot, plugin, db):
+    # The live minutes get the same lines and counts without a pass over the whole log
+    await bot.send("!startmeeting")
+    await bot.send("foo\n^action ask around", sender="@other:example.com")
+    await bot.send("!topic pants\n^info bar\nbaz")
+
+    meeting_id = plugin.meeting_id("testroom")
+    export = await plugin.export(meeting_id)
+    live = await plugin.live_export(meeting_id)
+
+    def lines(lines):
+        return [(line.timestamp, line.sender, line.line_num, line.message) for line in lines]
+
+    assert lines([live.first, live.last]) == lines([export.first, export.last])
+    assert live.chair == export.chair
+    assert lines(live.items) == lines(export.items)
+    assert lines(live.actions) == lines(export.actions)
+    assert live.people_present == export.people_present
+
+    live = await plugin.live_export("missing")
+    assert (live.first, live.items, live.people_present) == (None, [], [])
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_iter_items_tied_lines(plugin, db):
+    # Lines from events sent by the same sender in the same millisecond share their sort key, so
+    # none may be lost where one chunk ends and the next begins
+    await db.executemany(
+        "INSERT INTO meeting_logs (meeting_id, timestamp, sender, message, tag, topic, line_num) "
+        "VALUES ($1, $2, $3, $4, $5, $6, $7)",
+        [("meeting", 1000, "@a:example.com", message, None, "", 0) for message in "abc"],
+    )
+    lines = [line.message async for line in plugin.iter_items("meeting", chunk_size=1)]
+    assert lines == ["a", "b", "c"]
@@ -0,0 +1,63 @@
+import httpx
+import pytest
+import pytest_asyncio
+
+pytest.importorskip("httpx_gssapi")
+
+from meetings.backends import fedora
+
+
+@pytest_asyncio.fixture
+async def plugin_config_overrides(tmp_path):
+    return {
+        "backend": "fedora",
+        "backend_data": {
+            "fedora": {
+                "fasjson_url": "https://fasjson.example.com",
+                "logs_baseurl": "https://meetbot.example.com/",
+                "logs_directory": str(tmp_path),
+                "send_fedoramessages": False,
+            }
+        },
+    }
+
+
+async def test_endmeeting_writes_files(bot, plugin, db, tmp_path, respx_mock):
+    respx_mock.get("https://fasjson.example.com/v1/search/users/").mock(
+        return_value=httpx.Response(200, json={"result": [{"username": "dummy"}]})
+    )
+    await bot.send("!startmeeting")
+    await bot.send("!topic pants\n^info trousers")
+    await bot.send("!endmeeting")
+    await plugin.jobs.run_due()
+
+    directory = tmp_path / "testroom_matrix_example-com" / "1970-01-01"
+    files = sorted(p.name for p in directory.iterdir())
+    assert files == [
+        "test-room.1970-01-01-00.00.html",
+        "test-room.1970-01-01-00.00.log.html",
+        "test-room.1970-01-01-00.00.log.txt",
+        "test-room.1970-01-01-00.00.txt",
+    ]
+    text_log = (directory / "test-room.1970-01-01-00.00.log.txt").read_text()
+    assert "<@dummy:example.com> ^info trousers" in text_log
+    text_minutes = (directory / "test-room.1970-01-01-00.00.txt").read_text()
+    assert "* TOPIC: pants" in text_minutes
+    assert "    * INFO: trousers" in text_minutes
+
+    replies = [sent.content.body for sent in bot.sent[-4:]]
+    assert replies[0].startswith("Text Log: https://meetbot.example.com/")
+    assert replies[3].startswith("HTML Minutes: https://meetbot.example.com/")
+
+    # the FASJSON lookup was cached for next time
+    assert await db.fetchval("SELECT fas_name FROM fasjson_cache") == "dummy"
+
+
+async def test_fasjson_errors_not_cached(plugin, db, respx_mock):
+    # An outage isn't remembered as the user having no FAS account
+    respx_mock.get("https://fasjson.example.com/v1/search/users/").mock(
+        return_value=httpx.Response(500, json={"message": "Internal Server Error"})
+    )
+    mxid = "@someone:example.com"
+    assert await fedora._get_fasname_from_mxid(plugin, None, mxid) == mxid
+    assert await db.fetchval("SELECT COUNT(*) FROM fasjson_cache") == 0
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+import pytest
+
+pytest.importorskip("httpx_gssapi")
+
+from fedora_messaging import exceptions as fm_exceptions
+from meetbot_messages import MeetingStartV1
+
+from meetings.backends.fedora import publisher
+
+
+def start_message():
+    return MeetingStartV1(
+        body={
+            "start_time": "2023-09-01T10:00:00+1000",
+            "start_user": "dummy",
+            "location": "#testroom:example.com",
+            "meeting_name": "Test Room",
+        }
+    )
+
+
+async def wait_for_outbox(db, count):
+    for _ in range(100):
+        if await db.fetchval("SELECT COUNT(*) FROM fedora_messages_outbox") == count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("outbox never reached the expected size")
+
+
+async def test_publish_from_outbox(db, monkeypatch):
+    published = []
+    monkeypatch.setattr(publisher.fm_api, "publish", published.append)
+    fm_publisher = publisher.Publisher(db, logging.getLogger("publisher"))
+    fm_publisher.start()
+    message = start_message()
+    await fm_publisher.enqueue(message)
+    await wait_for_outbox(db, 0)
+    await fm_publisher.stop()
+
+    assert [m.id for m in published] == [message.id]
+    assert published[0].body == message.body
+
+
+async def test_failed_publish_is_retried_later(db, monkeypatch):
+    def publish(message):
+        raise fm_exceptions.ConnectionException(reason="broker is down")
+
+    monkeypatch.setattr(publisher.fm_api, "publish", publish)
+    fm_publisher = publisher.Publisher(db, logging.getLogger("publisher"))
+    message = start_message()
+    await fm_publisher.enqueue(message)
+    delay = await fm_publisher.publish_due()
+
+    row = await db.fetchrow("SELECT * FROM fedora_messages_outbox")
+    assert row["message_id"] == message.id
+    assert row["attempts"] == 1
+    assert publisher.PUBLISH_BACKOFF - 1 <= delay <= publisher.PUBLISH_BACKOFF
+
+
+async def test_bad_messages_are_dropped(db, monkeypatch):
+    # Messages that can never be published don't block the ones queued after them
+    published = []
+
+    def publish(message):
+        if message.body["meeting_name"] == "invalid":
+            raise fm_exceptions.ValidationError("doesn't match the schema")
+        published.append(message)
+
+    monkeypatch.setattr(publisher.fm_api, "publish", publish)
+    fm_publisher = publisher.Publisher(db, logging.getLogger("publisher"))
+    await db.execute(
+        "INSERT INTO fedora_messages_outbox (message_id, message) VALUES ($1, $2)",
+        "garbled",
+        "not json",
+    )
+    invalid = start_message()
+    invalid.body["meeting_name"] = "invalid"
+    await fm_publisher.enqueue(invalid)
+    message = start_message()
+    await fm_publisher.enqueue(message)
+
+    assert await fm_publisher.publish_due() is None
+    assert [m.id for m in published] == [message.id]
+    assert await db.fetchval("SELECT COUNT(*) FROM fedora_messages_outbox") == 0
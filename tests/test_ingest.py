@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from meetings.ingest import IngestQueue
+
+
+async def test_order_and_concurrency():
+    processed = []
+    running = 0
+    most_running = 0
+
+    async def process(evt):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.001 * (evt[1] % 3))
+        processed.append(evt)
+        running -= 1
+        return evt[1]
+
+    ingest = IngestQueue(process, concurrency=3, room_queue_size=2)
+    events = [(f"room{n % 5}", n) for n in range(50)]
+    results = await asyncio.gather(*(ingest.submit(room, (room, n)) for room, n in events))
+
+    assert results == list(range(50))
+    assert most_running == 3
+    for room in {room for room, _ in events}:
+        assert [evt for evt in processed if evt[0] == room] == [
+            evt for evt in events if evt[0] == room
+        ]
+    assert ingest.queues == ingest.workers == ingest.submitters == {}
+
+
+async def test_errors_reach_the_submitter():
+    async def process(evt):
+        if evt == "bad":
+            raise ValueError(evt)
+        return evt
+
+    ingest = IngestQueue(process)
+    bad, good = await asyncio.gather(
+        ingest.submit("room", "bad"), ingest.submit("room", "good"), return_exceptions=True
+    )
+    assert isinstance(bad, ValueError)
+    assert good == "good"
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_room_events_in_order(bot, plugin, db):
+    # Events that arrive together are still logged one after the other, in order
+    await bot.send("!startmeeting")
+    await asyncio.gather(
+        bot.send("!topic first"),
+        bot.send("foo"),
+        bot.send("!topic second"),
+        bot.send("bar"),
+        bot.send("other room", room_id="otherroom"),
+    )
+
+    items = await plugin.get_items(plugin.meeting_id("testroom"))
+    assert [(row["message"], row["topic"]) for row in items] == [
+        ("!startmeeting", ""),
+        ("!topic first", "first"),
+        ("foo", "first"),
+        ("!topic second", "second"),
+        ("bar", "second"),
+    ]
+    assert plugin.meeting_in_progress("testroom")["topic"] == "second"
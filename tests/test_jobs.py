@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from meetings import jobs
+from meetings.backends import Backend
+
+
+async def wait_for_jobs(db):
+    for _ in range(100):
+        if await db.fetchval("SELECT COUNT(*) FROM meeting_jobs") == 0:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("meeting jobs never finished")
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_endmeeting_queues_job(bot, plugin, db):
+    # The meeting ends straight away, and the logs are kept until the job has run
+    await plugin.jobs.stop()
+    await bot.send("!startmeeting")
+    await bot.send("foo")
+    await plugin.dispatcher.drain()
+    await bot.send("!endmeeting")
+
+    assert bot.sent[-1].content.body.startswith("Meeting ended at")
+    assert plugin.meeting_in_progress("testroom") is None
+    job = await db.fetchrow("SELECT * FROM meeting_jobs")
+    assert job["meeting_id"] == plugin.meeting_id("testroom")
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_logs") == 3
+
+    # e.g. after a restart, the queue picks up where it left off
+    plugin.jobs.start()
+    await wait_for_jobs(db)
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_logs") == 0
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_new_meeting_while_job_queued(bot, plugin, db):
+    # A second meeting on the same day doesn't get mixed up with the first one's logs
+    await plugin.jobs.stop()
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    await bot.send("!startmeeting")
+
+    meeting = plugin.meeting_in_progress("testroom")
+    assert meeting["meeting_id"] != plugin.meeting_id("testroom")
+    items = await plugin.get_items(meeting["meeting_id"])
+    assert [row["message"] for row in items] == ["!startmeeting"]
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_failed_job_is_retried(bot, plugin, db):
+    async def endmeeting(meetbot, event, meeting):
+        raise RuntimeError("backend is broken")
+
+    await plugin.jobs.stop()
+    plugin.backends = [Backend("broken", SimpleNamespace(endmeeting=endmeeting))]
+    await bot.send("!startmeeting")
+    await bot.send("!endmeeting")
+    delay = await plugin.jobs.run_due()
+
+    job = await db.fetchrow("SELECT * FROM meeting_jobs")
+    assert job["attempts"] == 1
+    assert jobs.JOB_BACKOFF - 1 <= delay <= jobs.JOB_BACKOFF
+    assert await db.fetchval("SELECT COUNT(*) FROM meeting_logs") == 2
+    plugin.backends = []
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_failure_after_backends_counts_as_attempt(bot, plugin, db, monkeypatch):
+    # A job that fails anywhere is retried with backoff, and doesn't hold up the other jobs
+    add = plugin.archive.add
+
+    async def broken_add(conn, meeting):
+        if meeting["room_id"] == "room1":
+            raise RuntimeError("archive is broken")
+        await add(conn, meeting)
+
+    await plugin.jobs.stop()
+    monkeypatch.setattr(plugin.archive, "add", broken_add)
+    for room_id in ("room1", "room2"):
+        await bot.send("!startmeeting", room_id)
+        await bot.send("!endmeeting", room_id)
+    await plugin.jobs.run_due()
+
+    job = await db.fetchrow("SELECT * FROM meeting_jobs")
+    assert (job["room_id"], job["attempts"]) == ("room1", 1)
+    assert await db.fetchval("SELECT room_id FROM meeting_archive") == "room2"
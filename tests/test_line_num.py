@@ -26,3 +26,20 @@ async def test_get_items_order(bot, plugin, db):
     assert meeting_logs[1]["message"] == "foo"
     assert meeting_logs[2]["message"] == "bar"
     assert meeting_logs[3]["message"] == "baz"
+
+
+async def test_iter_items_order(bot, plugin, db):
+    # Streaming the logs in chunks gives the same rows, in the same order, as get_items
+    room_id = "room123"
+    await bot.send("!startmeeting", room_id)
+    await bot.send("foo\nbar\nbaz", room_id)
+    await bot.send("qux", room_id)
+
+    meeting_id = plugin.meeting_id(room_id)
+    streamed = [row["message"] async for row in plugin.iter_items(meeting_id, chunk_size=2)]
+    assert streamed == [row["message"] for row in await plugin.get_items(meeting_id)]
+    assert streamed == ["!startmeeting", "foo", "bar", "baz", "qux"]
+
+    export = await plugin.export(meeting_id)
+    assert export.first["message"] == "!startmeeting"
+    assert export.last["message"] == "qux"
@@ -0,0 +1,51 @@
+import pytest
+
+from meetings.logline import LogLine, format_second
+from meetings.util import time_from_timestamp
+
+
+@pytest.mark.parametrize(
+    "message,tag,command,text",
+    [
+        ("hello", None, "", "hello"),
+        ("!startmeeting Weekly", None, "startmeeting", "!startmeeting Weekly"),
+        ("!topic Release", "topic", "topic", "!topic Release"),
+        ("^topic Release", "topic", "", "Release"),
+        ("!topical", None, "topic", "!topical"),
+        ("^info  something", "info", "", "something"),
+        ("something ^action", "action", "", "something ^action"),
+    ],
+)
+def test_parsed(message, tag, command, text):
+    line = LogLine("m", 1700000000123, "@a:example.com", message, tag, "", 0)
+    assert line.command == command
+    assert line.text == text
+    assert line["message"] == message
+
+
+def test_custom_prefix():
+    line = LogLine("m", 0, "@a:example.com", "#info done", "info", "", 0, prefix="#")
+    assert line.text == "done"
+
+
+def test_timestamps():
+    format_second.cache_clear()
+    lines = [LogLine("m", 1700000000000 + ms, "@a:example.com", "", None, "", 0) for ms in (1, 999)]
+    assert lines[0].datetime == time_from_timestamp(1700000000000)
+    assert lines[0].time == time_from_timestamp(1700000000000, format="%H:%M:%S")
+    assert format_second.cache_info().hits == 1
+
+
+def test_from_row():
+    assert LogLine.from_row(None) is None
+    row = {
+        "meeting_id": "m",
+        "timestamp": 0,
+        "sender": "@a:example.com",
+        "message": "^idea x",
+        "tag": "idea",
+        "topic": "t",
+        "line_num": 3,
+    }
+    line = LogLine.from_row(row)
+    assert (line.topic, line.line_num, line.text) == ("t", 3, "x")
@@ -0,0 +1,62 @@
+import logging
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+from meetings.metrics import Histogram, query_name
+
+
+def test_query_name():
+    assert query_name("SELECT * FROM meeting_logs WHERE meeting_id = $1") == "SELECT meeting_logs"
+    assert query_name("\n  INSERT INTO meeting_attendance (meeting_id) VALUES ($1)") == (
+        "INSERT meeting_attendance"
+    )
+    assert query_name("UPDATE meetings SET topic = $3") == "UPDATE meetings"
+    assert query_name("VACUUM") == "VACUUM"
+
+
+def test_histogram():
+    histogram = Histogram("test_seconds", "Test", buckets=(0.1, 1))
+    histogram.observe(0.05, phase="a")
+    histogram.observe(0.5, phase="a")
+    assert histogram.render().splitlines()[2:] == [
+        'test_seconds_bucket{phase="a",le="0.1"} 1',
+        'test_seconds_bucket{phase="a",le="1"} 2',
+        'test_seconds_bucket{phase="a",le="+Inf"} 2',
+        'test_seconds_sum{phase="a"} 0.55',
+        'test_seconds_count{phase="a"} 2',
+    ]
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_metrics_page(bot, plugin):
+    await bot.send("!startmeeting")
+    await bot.send("foo\n^info bar")
+
+    response = await plugin.metrics_page(make_mocked_request("GET", "/metrics"))
+    assert response.content_type == "text/plain"
+    metrics = response.body.decode().splitlines()
+    assert "meetings_lines_total 3" in metrics
+    assert 'meetings_tags_total{tag="info"} 1' in metrics
+    assert 'meetings_sent_total{kind="reaction"} 1' in metrics
+    assert "meetings_active 1" in metrics
+    assert "meetings_event_seconds_count 2" in metrics
+    assert 'meetings_command_seconds_count{command="startmeeting"} 1' in metrics
+    assert 'meetings_db_query_seconds_count{query="INSERT meeting_logs"} 2' in metrics
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_slow_events_logged(bot, plugin, caplog):
+    # Only the metrics logger is checked, as anything else may log warnings along the way
+    plugin.metrics.log = logging.getLogger("metrics")
+    await bot.send("!startmeeting")
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        await bot.send("foo")
+    assert not [record for record in caplog.records if record.name == "metrics"]
+
+    plugin.metrics.slow_threshold = 1e-9
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        await bot.send("foo")
+    [record] = [record for record in caplog.records if record.name == "metrics"]
+    assert record.getMessage().startswith("Slow meetings_event_seconds ")
+    assert 'meetings_db_query_seconds{query="INSERT meeting_logs"}' in record.getMessage()
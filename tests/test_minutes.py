@@ -0,0 +1,91 @@
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import make_mocked_request
+
+
+@pytest_asyncio.fixture
+async def plugin_config_overrides():
+    # Nothing is posted to Discourse until the meeting ends
+    return {
+        "backend": "ansible",
+        "backend_data": {
+            "ansible": {
+                "discourse_user": "meetbot",
+                "discourse_key": "key",
+                "discourse_url": "http://discourse.example.com",
+                "category_id": 1,
+            }
+        },
+        "web_token": "sekrit",
+    }
+
+
+async def test_minutes_command(bot, plugin):
+    await bot.send("!startmeeting")
+    await bot.send("^info something useful")
+    await bot.send("!minutes")
+
+    minutes = bot.sent[-1].content
+    assert "something useful" in minutes.formatted_body
+    assert "something useful" in minutes.body
+
+
+async def test_minutes_cache(bot, plugin):
+    await bot.send("!startmeeting")
+    await bot.send("^info something useful")
+    meeting = plugin.meeting_in_progress("testroom")
+
+    # Untagged lines don't change the minutes, so they aren't rendered again
+    minutes = await plugin.get_minutes(meeting)
+    await bot.send("just chatting")
+    assert await plugin.get_minutes(meeting) is minutes
+
+    await bot.send("^action someone does something")
+    updated = await plugin.get_minutes(meeting)
+    assert updated[2] != minutes[2]
+    assert "someone does something" in updated[1]
+
+    await bot.send("!meetingname a new name")
+    assert "a new name" in (await plugin.get_minutes(meeting))[1]
+
+
+async def test_minutes_page(bot, plugin):
+    request = make_mocked_request(
+        "GET",
+        "/minutes/testroom",
+        headers={"Authorization": "Bearer sekrit"},
+        match_info={"room_id": "testroom"},
+    )
+    response = await plugin.minutes_page(request)
+    assert response.status == 404
+
+    await bot.send("!startmeeting")
+    await bot.send("^info something useful")
+    response = await plugin.minutes_page(request)
+    assert response.status == 200
+    assert "something useful" in response.text
+
+    request = make_mocked_request(
+        "GET",
+        "/minutes/testroom",
+        headers={"If-None-Match": response.headers["ETag"], "Authorization": "Bearer sekrit"},
+        match_info={"room_id": "testroom"},
+    )
+    response = await plugin.minutes_page(request)
+    assert response.status == 304
+
+    # The minutes aren't served without the token, or when there's no token to check
+    request = make_mocked_request("GET", "/minutes/testroom", match_info={"room_id": "testroom"})
+    assert (await plugin.minutes_page(request)).status == 401
+    plugin.config["web_token"] = ""
+    request = make_mocked_request(
+        "GET", "/minutes/testroom?token=", match_info={"room_id": "testroom"}
+    )
+    assert (await plugin.minutes_page(request)).status == 404
+
+
+@pytest.mark.parametrize("plugin_config_overrides", [{"backend": ""}])
+async def test_minutes_without_backend(bot, plugin):
+    await bot.send("!startmeeting")
+    await bot.send("!minutes")
+    assert bot.sent[-1].content.body == "Minutes are only available when a backend is configured"
@@ -0,0 +1,30 @@
+from mautrix.types import EventType, PowerLevelStateEventContent
+
+from .bot import SENDER
+
+
+def power_level_requests(bot):
+    return [r for r in bot.state_requests if r[1] == EventType.ROOM_POWER_LEVELS]
+
+
+async def test_power_levels_cached(bot, plugin, db):
+    # Only the first permission check in a room goes to the homeserver
+    await bot.send("!startmeeting")
+    await bot.send("!topic pants")
+    await bot.send("!meetingname trousers")
+    assert len(power_level_requests(bot)) == 1
+
+
+async def test_power_levels_updated_from_state_event(bot, plugin, db):
+    # A new m.room.power_levels event replaces the cached power levels for that room
+    await bot.send("!startmeeting")
+    await plugin.dispatcher.drain()
+    await bot.send_state(
+        EventType.ROOM_POWER_LEVELS, PowerLevelStateEventContent(users={SENDER: 0})
+    )
+    await bot.send("!topic pants")
+
+    meeting_logs = await db.fetch("SELECT * FROM meeting_logs ORDER BY timestamp")
+    assert meeting_logs[-1]["tag"] is None
+    assert bot.sent[-1].content.body.startswith("Changing the topic requires a powerlevel")
+    assert len(power_level_requests(bot)) == 1
@@ -0,0 +1,19 @@
+from mautrix.types import EventType, RoomNameStateEventContent
+
+from meetings.util import get_room_info
+
+
+async def test_room_metadata_cached(bot):
+    assert await get_room_info(bot.client, "testroom") == ["Test Room", "@testroom:example.com"]
+    assert await get_room_info(bot.client, "testroom") == ["Test Room", "@testroom:example.com"]
+    assert len(bot.state_requests) == 2
+
+
+async def test_room_name_updated_from_state_event(bot, plugin, db):
+    # A renamed room is picked up from the m.room.name event rather than a fresh lookup
+    await bot.send_state(EventType.ROOM_NAME, RoomNameStateEventContent(name="Renamed Room"))
+    await bot.send("!startmeeting")
+
+    meeting = await db.fetchrow("SELECT * FROM meetings")
+    assert meeting["meeting_name"] == "Renamed Room"
+    assert (bot.state_requests.count(("testroom", EventType.ROOM_NAME))) == 0
@@ -0,0 +1,62 @@
+import logging
+import sys
+
+import pytest
+from mautrix.util.async_db import Database
+
+from meetings.backends import load_backend
+from meetings.db import upgrade_table
+from meetings.metrics import Metrics
+from meetings.startup import LazyModule, StartupReport, import_seconds, upgrade_steps
+
+
+def test_lazy_module(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    colorsys = LazyModule("colorsys")
+    assert "colorsys" not in sys.modules
+
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert "colorsys" in sys.modules
+    assert "colorsys" in import_seconds
+
+
+def test_lazy_module_missing():
+    with pytest.raises(ModuleNotFoundError):
+        LazyModule("no_such_module.submodule")
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="Unknown backend"):
+        load_backend("nonexistent")
+
+
+async def test_upgrade_steps_reported(tmp_path):
+    db = Database.create(
+        f"sqlite:///{tmp_path.joinpath('startup.db').as_posix()}",
+        upgrade_table=upgrade_table,
+        log=logging.getLogger("db"),
+    )
+    await db.start()
+    await db.stop()
+    steps = upgrade_steps.get()
+    assert [step for step, _ in steps][:2] == ["db v1: Initial revision", "db v2: add topics"]
+    assert len(steps) == len(upgrade_table.upgrades)
+
+    metrics = Metrics(logging.getLogger("metrics"))
+    report = StartupReport()
+    with report.step("something"):
+        pass
+    report.finish(logging.getLogger("startup"), metrics)
+    assert upgrade_steps.get() is None
+
+    rendered = metrics.render()
+    assert 'meetings_startup_seconds{step="db v2: add topics"}' in rendered
+    assert 'meetings_startup_seconds{step="something"}' in rendered
+    assert 'meetings_startup_seconds{step="total"}' in rendered
+
+
+async def test_plugin_startup_metrics(plugin):
+    rendered = plugin.metrics.render()
+    assert 'meetings_startup_seconds{step="import backends"}' in rendered
+    assert 'meetings_startup_seconds{step="load meetings"}' in rendered
+    assert 'meetings_import_seconds{module="meetings.backends.ansible"}' in rendered
@@ -0,0 +1,28 @@
+async def test_topic_in_multiline_message(bot, plugin, db):
+    # A topic change part way through a paste applies to the lines that follow it
+    await bot.send("!startmeeting")
+    await bot.send("foo\n!topic pants\n^info bar\nbaz")
+
+    meeting_logs = await db.fetch("SELECT * FROM meeting_logs ORDER BY timestamp, line_num")
+    assert [(row["message"], row["tag"], row["topic"]) for row in meeting_logs] == [
+        ("!startmeeting", None, ""),
+        ("foo", None, ""),
+        ("!topic pants", "topic", "pants"),
+        ("^info bar", "info", "pants"),
+        ("baz", None, "pants"),
+    ]
+
+    meeting = await db.fetchrow("SELECT * FROM meetings")
+    assert meeting["topic"] == "pants"
+
+
+async def test_topic_carries_over(bot, plugin, db):
+    # The topic set in one message is used for the messages after it
+    await bot.send("!startmeeting")
+    await bot.send("!topic pants")
+    await bot.send("foo")
+
+    meeting_logs = await db.fetch("SELECT * FROM meeting_logs ORDER BY timestamp, line_num")
+    assert meeting_logs[1]["tag"] == "topic"
+    assert meeting_logs[2]["tag"] is None
+    assert meeting_logs[2]["topic"] == "pants"
@@ -0,0 +1,21 @@
+from meetings.util import TTLCache
+
+
+def test_ttl_cache_expiry():
+    cache = TTLCache(ttl=-1)
+    cache["foo"] = "bar"
+    assert "foo" not in cache
+    assert cache.get("foo") is None
+
+
+def test_ttl_cache_eviction():
+    cache = TTLCache(ttl=60, maxsize=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache["a"] == 1
+    cache["c"] = 3
+    # "b" was the least recently used entry
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
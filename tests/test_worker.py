@@ -0,0 +1,42 @@
+import asyncio
+import logging
+
+from meetings.worker import Worker
+
+
+class Counter(Worker):
+    doing = "counting"
+    error_delay = 0
+
+    def __init__(self, log):
+        super().__init__(log)
+        self.runs = 0
+        self.ran = asyncio.Event()
+
+    async def run_once(self):
+        self.runs += 1
+        self.ran.set()
+        if self.runs == 1:
+            raise RuntimeError("first run fails")
+        # wait for a wakeup
+        return None
+
+
+async def test_worker(caplog):
+    worker = Counter(logging.getLogger("worker"))
+    worker.start()
+    # the first run fails, and is retried after error_delay
+    while worker.runs < 2:
+        await asyncio.sleep(0)
+    assert "Error counting: first run fails" in caplog.text
+
+    # after that, it only runs again once woken up
+    worker.ran.clear()
+    await asyncio.sleep(0.01)
+    assert worker.runs == 2
+    worker.wakeup.set()
+    await asyncio.wait_for(worker.ran.wait(), timeout=1)
+    assert worker.runs == 3
+
+    await worker.stop()
+    assert worker.task is None